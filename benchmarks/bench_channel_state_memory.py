@@ -0,0 +1,65 @@
+"""Resident memory of duckhunt ChannelState records for many channels.
+
+Builds the cog's ``game_status`` mapping for 100k channels and reports the
+bytes held per channel. For comparison it also reports the size of one
+munchified config, which each ChannelState used to parse and keep.
+
+Run from the repository root::
+
+    python benchmarks/bench_channel_state_memory.py [channels]
+    python -m benchmarks.bench_channel_state_memory [channels]
+"""
+from collections import defaultdict
+import os
+import sys
+from time import perf_counter
+import tracemalloc
+
+from munch import munchify
+import yaml
+
+# as a script, benchmarks/ is on the path rather than the repository root
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.duckhunt import ChannelState, DuckSettings
+
+
+def measure(func):
+    tracemalloc.start()
+    start = perf_counter()
+    result = func()
+    elapsed = perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main():
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    with open("config.default.yml") as f:
+        raw = f.read()
+
+    options = munchify(yaml.safe_load(raw)).duckhunt_options
+    settings = DuckSettings(options)
+
+    def build():
+        game_status = defaultdict(lambda: defaultdict(lambda: ChannelState(settings)))
+        for i in range(channels):
+            # roughly 50 channels per guild
+            game_status[i // 50][i].handle_message(i)
+        return game_status
+
+    _, size, elapsed = measure(build)
+    print(f"{channels} channels: {size / 2**20:.1f} MiB, {size / channels:.0f} B/channel, {elapsed:.2f}s to create")
+
+    _, config_size, config_time = measure(lambda: munchify(yaml.safe_load(raw)))
+    print(
+        f"old per-channel config: {config_size} B and {config_time * 1e3:.2f} ms each, "
+        f"~{config_size * channels / 2**20:.0f} MiB for {channels} channels"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Commands per second through ``Stats.register_command`` under each logging setup.
+
+``disabled`` drops INFO records, ``file`` writes them with a RotatingFileHandler
+on the calling thread, and ``queue`` hands them to launcher's QueueListener
+thread, as ``launcher.setup_logging`` does.
+
+Run from the repository root::
+
+    python benchmarks/bench_command_logging.py [commands]
+    python -m benchmarks.bench_command_logging [commands]
+"""
+import asyncio
+from collections import Counter
+import logging
+from logging.handlers import QueueListener, RotatingFileHandler
+import os
+import queue
+import sys
+import tempfile
+from time import perf_counter
+from types import SimpleNamespace
+import datetime
+
+# as a script, benchmarks/ is on the path rather than the repository root
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.stats import Stats
+from launcher import JsonFormatter, LogQueueHandler
+
+FORMAT = logging.Formatter('[{asctime}] [{levelname:<7}][{filename}:{lineno:<4}] {name}: {message}', style='{')
+
+
+def make_cog():
+    cog = Stats.__new__(Stats)
+    cog.bot = SimpleNamespace(command_stats=Counter())
+    cog._batch_lock = asyncio.Lock()
+    cog._data_batch = []
+    # never reached, so nothing touches the database
+    cog.batch_size = float('inf')
+    return cog
+
+
+def make_ctx():
+    guild = SimpleNamespace(id=1)
+    channel = SimpleNamespace(id=2)
+    author = SimpleNamespace(id=3)
+    message = SimpleNamespace(
+        created_at=datetime.datetime.utcnow(),
+        author='someone#0001',
+        channel='general',
+        guild='guild',
+        content='!ducks someone else',
+    )
+    return SimpleNamespace(
+        command=SimpleNamespace(qualified_name='ducks_user'),
+        message=message,
+        guild=guild,
+        channel=channel,
+        author=author,
+        prefix='!',
+        command_failed=False,
+    )
+
+
+async def replay(cog, ctx, count):
+    register = cog.register_command
+    start = perf_counter()
+    for _ in range(count):
+        await register(ctx)
+    return perf_counter() - start
+
+
+def run(mode, count, directory, formatter):
+    root = logging.getLogger()
+    listener = None
+    handler = None
+    if mode == 'disabled':
+        root.setLevel(logging.WARNING)
+    else:
+        root.setLevel(logging.INFO)
+        handler = RotatingFileHandler(os.path.join(directory, f'{mode}.log'), encoding='utf-8', maxBytes=32 * 1024 * 1024, backupCount=1)
+        handler.setFormatter(formatter)
+        if mode == 'queue':
+            listener = QueueListener(queue.SimpleQueue(), handler, respect_handler_level=True)
+            root.addHandler(LogQueueHandler(listener.queue))
+            listener.start()
+        else:
+            root.addHandler(handler)
+
+    try:
+        elapsed = asyncio.run(replay(make_cog(), make_ctx(), count))
+    finally:
+        if listener is not None:
+            listener.stop()
+        for hdlr in root.handlers[:]:
+            root.removeHandler(hdlr)
+        if handler is not None:
+            handler.close()
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with tempfile.TemporaryDirectory() as directory:
+        elapsed = run('disabled', count, directory, None)
+        print(f"disabled: {count / elapsed:,.0f} commands/sec")
+        for name, formatter in (('text', FORMAT), ('json', JsonFormatter())):
+            for mode in ('file', 'queue'):
+                elapsed = run(mode, count, directory, formatter)
+                print(f"{mode} ({name}): {count / elapsed:,.0f} commands/sec")
+
+
+if __name__ == "__main__":
+    main()
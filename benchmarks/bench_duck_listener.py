@@ -0,0 +1,90 @@
+"""Throughput of the duckhunt ``increment_msg_counter`` listener.
+
+Replays a synthetic stream of messages from many authors across a few busy
+channels with a running hunt, and compares the set-based speaker tracking
+with the old list scan.
+
+Run from the repository root::
+
+    python benchmarks/bench_duck_listener.py [messages] [authors]
+    python -m benchmarks.bench_duck_listener [messages] [authors]
+"""
+import asyncio
+from collections import defaultdict
+import os
+import random
+import sys
+from time import perf_counter, time
+from types import SimpleNamespace
+
+# as a script, benchmarks/ is on the path rather than the repository root
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.duckhunt import ChannelState, DuckSettings, Duckhunt
+
+
+class ListChannelState(ChannelState):
+    """The previous behaviour: a list of every speaker, scanned per message"""
+
+    __slots__ = ()
+
+    def handle_message(self, author_id):
+        if self.game_on and self.duck_status == 0:
+            self.messages += 1
+            if author_id not in self.masks:
+                self.masks.append(author_id)
+
+
+def make_cog(state_cls, settings):
+    cog = Duckhunt.__new__(Duckhunt)
+    cog.settings = settings
+    cog.opt_out = defaultdict(list)
+    cog.game_status = defaultdict(lambda: defaultdict(lambda: make_state(state_cls, settings)))
+    return cog
+
+
+def make_state(state_cls, settings):
+    state = state_cls(settings)
+    if state_cls is ListChannelState:
+        state.masks = []
+    state.game_on = True
+    # a duck is scheduled far away, so the listener only counts
+    state.next_duck_time = time() + 3600
+    return state
+
+
+def make_messages(count, authors):
+    rand = random.Random(1)
+    guild = SimpleNamespace(id=1)
+    channels = [SimpleNamespace(id=i) for i in range(1, 6)]
+    users = [SimpleNamespace(id=i) for i in range(authors)]
+    return [
+        SimpleNamespace(guild=guild, channel=rand.choice(channels), author=rand.choice(users))
+        for _ in range(count)
+    ]
+
+
+async def replay(cog, messages):
+    listener = cog.increment_msg_counter
+    start = perf_counter()
+    for msg in messages:
+        await listener(msg)
+    return perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    authors = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+    settings = DuckSettings({"min_users": 2, "min_lines": 10})
+    messages = make_messages(count, authors)
+
+    loop = asyncio.new_event_loop()
+    for name, state_cls in (("list", ListChannelState), ("set", ChannelState)):
+        elapsed = loop.run_until_complete(replay(make_cog(state_cls, settings), messages))
+        print(f"{name:>4}: {count / elapsed:,.0f} messages/sec ({authors} authors)")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
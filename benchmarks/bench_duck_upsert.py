@@ -0,0 +1,123 @@
+"""Statements and time per duck hit, before and after the upsert/write-behind change.
+
+``before`` replays the old ``update_score``: SELECT, then UPDATE or INSERT,
+then a commit for every hit. ``upsert`` writes every hit on its own with
+``database.upsert``, which is the upsert change alone. ``buffered`` adds the
+write-behind ``ScoreBuffer`` on top and writes one upsert executemany per
+``flush_every`` hits.
+
+Run from the repository root::
+
+    python benchmarks/bench_duck_upsert.py [hits] [flush_every]
+    python -m benchmarks.bench_duck_upsert [hits] [flush_every]
+"""
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+from sqlalchemy import and_, create_engine, event, insert, select, update
+from sqlalchemy.orm import Session
+
+# as a script, benchmarks/ is on the path rather than the repository root
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.duckhunt import DuckHuntTable, ScoreBuffer
+from util import database
+
+table = DuckHuntTable
+
+
+def make_engine(path):
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    DuckHuntTable.__table__.create(engine)
+    counter = {"statements": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter["statements"] += 1
+
+    @event.listens_for(engine, "commit")
+    def count_commit(conn):
+        counter["statements"] += 1
+
+    return engine, counter
+
+
+def make_hits(count):
+    rand = random.Random(1)
+    return [
+        ("1", str(rand.randrange(20)), f"user{rand.randrange(200)}", rand.random() < 0.7)
+        for _ in range(count)
+    ]
+
+
+def before(session, hits, flush_every):
+    for network, chan, name, is_shot in hits:
+        shoot, friend = (1, 0) if is_shot else (0, 1)
+        clause = and_(table.network == network, table.chan == chan, table.name == name)
+        score = session.execute(select(table.shot, table.befriend).where(clause)).fetchone()
+        if score:
+            session.execute(update(table).where(clause).values(shot=score[0] + shoot, befriend=score[1] + friend))
+        else:
+            session.execute(insert(table).values(network=network, chan=chan, name=name, shot=shoot, befriend=friend))
+        session.commit()
+
+
+def upsert(session, hits, flush_every):
+    for network, chan, name, is_shot in hits:
+        shoot, friend = (1, 0) if is_shot else (0, 1)
+        row = {"network": network, "chan": chan, "name": name, "shot": shoot, "befriend": friend}
+        database.upsert(session, table, [row], ("network", "name", "chan"), increment=("shot", "befriend"))
+        session.commit()
+
+
+def buffered(session, hits, flush_every):
+    buffer = ScoreBuffer()
+
+    def flush():
+        rows = [
+            {"network": n, "chan": c, "name": name, "shot": s, "befriend": f}
+            for (n, c, name), (s, f) in buffer.take().items()
+        ]
+        database.upsert(session, table, rows, ("network", "name", "chan"), increment=("shot", "befriend"))
+        session.commit()
+
+    for i, (network, chan, name, is_shot) in enumerate(hits, 1):
+        buffer.add((network, chan, name), *((1, 0) if is_shot else (0, 1)))
+        if i % flush_every == 0:
+            flush()
+    flush()
+
+
+def main():
+    hits = make_hits(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+    flush_every = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    totals = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for func in (before, upsert, buffered):
+            engine, counter = make_engine(os.path.join(tmp, f"{func.__name__}.db"))
+            with Session(engine, future=True) as session:
+                start = perf_counter()
+                func(session, hits, flush_every)
+                elapsed = perf_counter() - start
+                totals[func.__name__] = session.execute(
+                    select(table.network, table.chan, table.name, table.shot, table.befriend)
+                    .order_by(table.network, table.chan, table.name)
+                ).fetchall()
+
+            print(
+                f"{func.__name__:>8}: {counter['statements'] / len(hits):.3f} statements/hit, "
+                f"{elapsed / len(hits) * 1e6:.1f} us/hit"
+            )
+            engine.dispose()
+
+    assert totals["before"] == totals["upsert"], "upsert path produced different scores"
+    assert totals["before"] == totals["buffered"], "buffered path produced different scores"
+
+
+if __name__ == "__main__":
+    main()
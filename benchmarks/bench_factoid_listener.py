@@ -0,0 +1,88 @@
+"""Messages per second through the ``Factoids.factoid`` on_message listener.
+
+Replays a stream where 0.1% of messages are factoid hits, plus a small share
+of prefixed misses, against a warm guild cache.
+
+Run from the repository root::
+
+    python benchmarks/bench_factoid_listener.py [messages]
+    python -m benchmarks.bench_factoid_listener [messages]
+"""
+import asyncio
+import os
+import random
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+
+# as a script, benchmarks/ is on the path rather than the repository root
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.factoids import FactoidCache, Factoids, FactoidTemplate, GuildFactoids
+
+GUILD_ID = 1
+
+
+class Channel:
+    sent = 0
+
+    async def send(self, **kwargs):
+        Channel.sent += 1
+
+
+def make_cog(words):
+    cog = Factoids.__new__(Factoids)
+    cog.factoid_char = "?"
+    cog.factoid_cache = FactoidCache(None)
+    cog.factoid_cache.guilds[str(GUILD_ID)] = GuildFactoids({
+        word: FactoidTemplate(f"<user> gets {word}") for word in words
+    })
+    return cog
+
+
+def make_messages(count, words):
+    rand = random.Random(1)
+    author = SimpleNamespace(bot=False)
+    guild = SimpleNamespace(id=GUILD_ID)
+    channel = Channel()
+    chatter = [
+        "did anyone see the game last night",
+        "lol",
+        "https://example.com/some/long/link?with=query&params=1",
+        "?? what",
+        "brb",
+    ]
+
+    messages = []
+    for _ in range(count):
+        roll = rand.random()
+        if roll < 0.001:
+            content = f"?{rand.choice(words)} someone"
+        elif roll < 0.01:
+            content = f"?notafactoid{rand.randrange(100)} hmm"
+        else:
+            content = rand.choice(chatter)
+        messages.append(SimpleNamespace(content=content, author=author, guild=guild, channel=channel))
+    return messages
+
+
+async def replay(cog, messages):
+    listener = cog.factoid
+    start = perf_counter()
+    for msg in messages:
+        await listener(msg)
+    return perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    words = [f"word{i}" for i in range(1000)]
+    messages = make_messages(count, words)
+
+    elapsed = asyncio.run(replay(make_cog(words), messages))
+    print(f"{count / elapsed:,.0f} messages/sec, {Channel.sent} factoids served")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Factoid write throughput against table size.
+
+For each table size, times ``!remember``-style writes through
+``Factoids.add_factoid`` with the incremental cache update, and with the full
+table re-read every write used to trigger. Each run stops after
+``TIME_LIMIT`` seconds, so the slow full-reload runs don't hold up the rest.
+
+Run from the repository root::
+
+    python benchmarks/bench_factoid_writes.py [writes]
+    python -m benchmarks.bench_factoid_writes [writes]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from sqlalchemy import insert, select
+
+# as a script, benchmarks/ is on the path rather than the repository root
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.factoids import FactoidCache, Factoids, FactoidsTable
+from util import database
+
+SIZES = (1_000, 10_000, 50_000)
+# seconds per run, the rate comes from the writes finished by then
+TIME_LIMIT = 1.0
+
+
+def make_cog():
+    cog = Factoids.__new__(Factoids)
+    cog.db = database.Session
+    cog.table = FactoidsTable
+    cog.factoid_cache = FactoidCache(cog.load_guild)
+    return cog
+
+
+def read_all(session):
+    """What every write used to cost on top of the write itself"""
+    cache = {}
+    for row in session.execute(select(FactoidsTable)).scalars().all():
+        cache.setdefault(row.chan, {})[row.word] = row.data
+    return cache
+
+
+def fill(engine, size):
+    rows = [
+        {"word": f"word{i}", "data": f"data {i}", "nick": "bench", "chan": str(i % 100)}
+        for i in range(size)
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(FactoidsTable), rows)
+
+
+async def write(cog, writes, full_reload):
+    start = perf_counter()
+    done = 0
+    while done < writes and perf_counter() - start < TIME_LIMIT:
+        await cog.add_factoid(f"new{done}", "1", f"new data {done}", "bench")
+        if full_reload:
+            await database.run(read_all)
+        done += 1
+    return done, perf_counter() - start
+
+
+async def main():
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    for size in SIZES:
+        for full_reload in (True, False):
+            with tempfile.TemporaryDirectory() as tmp:
+                engine, _ = database.create_engines(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+                database.configure(engine, future=True)
+                database.metadata.create_all(engine, tables=[FactoidsTable.__table__])
+                fill(engine, size)
+
+                cog = make_cog()
+                done, elapsed = await write(cog, writes, full_reload)
+                await database.close()
+                engine.dispose()
+
+            label = "full reload" if full_reload else "incremental"
+            print(f"{size:>7} rows, {label:>11}: {done / elapsed:,.0f} writes/sec ({done} writes)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""Messages per second through ``Bot.get_context`` for non-command messages.
+
+This is the prefix lookup that every message pays before any command check,
+replayed for guild messages that don't start with a prefix. The same stream
+is then run through ``process_commands``, which filters on the prefixes first.
+
+Run from the repository root::
+
+    python benchmarks/bench_get_context.py [messages]
+    python -m benchmarks.bench_get_context [messages]
+"""
+import asyncio
+import os
+import random
+import sys
+from collections import Counter
+from time import perf_counter
+from types import SimpleNamespace
+
+# as a script, benchmarks/ is on the path rather than the repository root
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import beeerbot
+from cogs.utils import context
+
+GUILD_COUNT = 100
+
+
+def make_bot():
+    bot = beeerbot.__new__(beeerbot)
+    # stands in for the prefixes.json IdConfig
+    bot.prefixes = {guild_id: ['!', '?'] for guild_id in range(0, GUILD_COUNT, 2)}
+    bot._mention_prefixes = None
+    bot._dm_prefixes = None
+    bot._guild_prefixes = {}
+    bot.prefix_filter_stats = Counter()
+    bot.all_commands = {}
+    bot._connection = SimpleNamespace(user=SimpleNamespace(id=80351110224678912))
+    # normally set by commands.Bot.__init__, skipped here with the config and cog loading
+    bot._skip_check = lambda author_id, self_id: author_id == self_id
+    bot.strip_after_prefix = False
+    return bot
+
+
+def make_messages(count):
+    rand = random.Random(1)
+    guilds = [SimpleNamespace(id=guild_id) for guild_id in range(GUILD_COUNT)]
+    author = SimpleNamespace(id=1, bot=False)
+    chatter = [
+        "did anyone see the game last night",
+        "lol",
+        "https://example.com/some/long/link?with=query&params=1",
+        "?? what",
+        "brb",
+    ]
+    # commands.Context reads the connection state off the message
+    state = SimpleNamespace()
+    return [
+        SimpleNamespace(content=rand.choice(chatter), author=author, guild=rand.choice(guilds), _state=state)
+        for _ in range(count)
+    ]
+
+
+async def replay(bot, messages):
+    get_context = bot.get_context
+    start = perf_counter()
+    for msg in messages:
+        await get_context(msg, cls=context.Context)
+    return perf_counter() - start
+
+
+async def replay_filtered(bot, messages):
+    process_commands = bot.process_commands
+    start = perf_counter()
+    for msg in messages:
+        await process_commands(msg)
+    return perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    messages = make_messages(count)
+
+    elapsed = asyncio.run(replay(make_bot(), messages))
+    print(f"get_context: {count / elapsed:,.0f} messages/sec")
+
+    bot = make_bot()
+    elapsed = asyncio.run(replay_filtered(bot, messages))
+    print(f"process_commands: {count / elapsed:,.0f} messages/sec, {bot.prefix_filter_stats['skipped']} skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,7 @@
 import os
 import sys
-from collections import Counter, deque, defaultdict
+from collections import Counter, defaultdict
 import asyncio
-import json
 from pathlib import Path
 import random
 from random import shuffle
@@ -10,7 +9,7 @@ import base64
 import requests
 import aiohttp
 import datetime
-from sqlalchemy import create_engine
+from time import perf_counter
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.schema import MetaData
@@ -24,8 +23,10 @@ import yaml
 from munch import munchify
 
 from cogs.utils import context
-from cogs.utils.config import Config
-from util import database
+from cogs.utils.cache import ExpiringCooldownMapping, ExpiringMap
+from cogs.utils.config import IdConfig
+from cogs.utils.ring import EventRing
+from util import database, metrics
 
 log = logging.getLogger(__name__)
 
@@ -40,18 +41,23 @@ initial_extensions = (
     'cogs.duckhunt',
     'cogs.cardsagainsthumanity',
     'cogs.stats',
+    'cogs.metrics',
     'cogs.botops'
 )
 
 
+_messages_skipped = metrics.MESSAGES.labels('skipped')
+_messages_passed = metrics.MESSAGES.labels('passed')
+
+
 def _prefix_callable(bot, msg):
-    user_id = bot.user.id
-    base = [f'<@!{user_id}> ', f'<@{user_id} ']
+    # runs for every message, so the tuples are built once and reused
     if msg.guild is None:
-        base.append('!')
-    else:
-        base.extend(bot.prefixes.get(msg.guild.id, ['!']))
-    return base
+        return bot._dm_prefixes or bot._build_prefixes(None)
+    try:
+        return bot._guild_prefixes[msg.guild.id]
+    except KeyError:
+        return bot._build_prefixes(msg.guild.id)
 
 class beeerbot(commands.Bot):
     def __init__(self):
@@ -74,32 +80,48 @@ class beeerbot(commands.Bot):
 
         self.session = aiohttp.ClientSession(loop=self.loop)
 
-        self._prev_events = deque(maxlen=10)
+        # the last decompressed gateway payloads, written to prev_events.bin on exit
+        # and read with `python3 launcher.py events prev_events.bin`
+        history = self.config.bot_options.get('gateway_event_history', 5000)
+        self.gateway_events = EventRing(history) if history > 0 else None
 
         # shows the last attempted IDENTIFYs and RESUMEs
         self.resumes = defaultdict(list)
         self.identifies = defaultdict(list)
 
         # guild_id: list
-        self.prefixes = Config('prefixes.json')
+        self.prefixes = IdConfig('prefixes.json')
+
+        # mention prefixes and guild_id: tuple of every prefix, see _build_prefixes
+        self._mention_prefixes = None
+        self._dm_prefixes = None
+        self._guild_prefixes = {}
+
+        # messages process_commands passed on to get_context or skipped
+        self.prefix_filter_stats = Counter()
+
+        # seconds after which a command is logged with its args and stack
+        self.slow_command_threshold = self.config.bot_options.get('slow_command_threshold', 2.0)
 
         # guild_id and user_id mapped to True
         # these are users and guilds globally blacklisted
         # from using the bot
-        self.blacklist = Config('blacklist.json')
+        # auto-bans come in bursts, so their writes are batched, see close()
+        self.blacklist = IdConfig('blacklist.json', save_delay=5.0)
 
         # in case of even further spam, add a cooldown mapping
         # for people who excessively spam commands
-        self.spam_control = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.user)
+        self.spam_control = ExpiringCooldownMapping.from_cooldown(10, 12.0, commands.BucketType.user)
 
         # A counter to auto-ban frequent spammers
         # Triggering the rate limit 5 times in a row will auto-ban the user from the bot.
-        self._auto_spam_count = Counter()
+        # Users who stop spamming are forgotten after an hour.
+        self._auto_spam_count = ExpiringMap(3600.0)
 
         # setup db
         db_path = self.config.bot_options.get('database', 'sqlite:///cloudbot.db')
-        self.db_engine = create_engine(db_path, future=True)
-        database.configure(self.db_engine, future=True)
+        self.db_engine, self.db_async_engine = database.create_engines(db_path)
+        database.configure(self.db_engine, future=True, async_bind=self.db_async_engine)
 
         # Set data path
         self.base_dir = Path().resolve()
@@ -116,8 +138,53 @@ class beeerbot(commands.Bot):
                 print(f'Failed to load extension {extension}.', file=sys.stderr)
                 traceback.print_exc()
 
-    async def on_socket_response(self, msg):
-        self._prev_events.append(msg)
+    def _build_prefixes(self, guild_id):
+        if self._mention_prefixes is None:
+            user_id = self.user.id
+            self._mention_prefixes = (f'<@!{user_id}> ', f'<@{user_id}> ')
+
+        if guild_id is None:
+            self._dm_prefixes = self._mention_prefixes + ('!',)
+            return self._dm_prefixes
+
+        prefixes = self._mention_prefixes + tuple(self.get_raw_guild_prefixes(guild_id))
+        self._guild_prefixes[guild_id] = prefixes
+        return prefixes
+
+    async def get_prefix(self, message):
+        # commands.Bot copies the prefixes into a new list every call,
+        # get_context works as well with the cached tuple
+        return _prefix_callable(self, message)
+
+    def get_guild_prefixes(self, guild):
+        proxy_msg = discord.Object(id=0)
+        proxy_msg.guild = guild
+        return list(_prefix_callable(self, proxy_msg))
+
+    def get_raw_guild_prefixes(self, guild_id):
+        return self.prefixes.get(guild_id, ['!'])
+
+    async def set_guild_prefixes(self, guild, prefixes):
+        if len(prefixes) > 10:
+            raise RuntimeError('Cannot have more than 10 custom prefixes.')
+
+        # put() stores the new prefixes before it awaits the write, so messages
+        # handled meanwhile rebuild the tuple from them
+        self._guild_prefixes.pop(guild.id, None)
+        try:
+            await self.prefixes.put(guild.id, sorted(set(prefixes), reverse=True))
+        finally:
+            self._guild_prefixes.pop(guild.id, None)
+
+    async def on_guild_remove(self, guild):
+        self._guild_prefixes.pop(guild.id, None)
+
+    def dispatch(self, event_name, *args, **kwargs):
+        # captured here instead of in a listener, which would start a task per event
+        # socket_response rather than socket_raw_receive, which is still zlib-stream compressed
+        if event_name == 'socket_response' and self.gateway_events is not None:
+            self.gateway_events.capture(args[0])
+        super().dispatch(event_name, *args, **kwargs)
 
     async def on_command_error(self, ctx, error):
         if isinstance(error, commands.NoPrivateMessage):
@@ -201,6 +268,14 @@ class beeerbot(commands.Bot):
         return wh.send(embed=embed)
 
     async def process_commands(self, message):
+        # most messages aren't commands, so don't build a Context for them
+        if not message.content.startswith(_prefix_callable(self, message)):
+            self.prefix_filter_stats['skipped'] += 1
+            _messages_skipped.inc()
+            return
+
+        self.prefix_filter_stats['passed'] += 1
+        _messages_passed.inc()
         ctx = await self.get_context(message, cls=context.Context)
 
         if ctx.command is None:
@@ -217,8 +292,9 @@ class beeerbot(commands.Bot):
         retry_after = bucket.update_rate_limit(current)
         author_id = message.author.id
         if retry_after and author_id != self.owner_id:
-            self._auto_spam_count[author_id] += 1
-            if self._auto_spam_count[author_id] >= 5:
+            spam_count = self._auto_spam_count.get(author_id, 0) + 1
+            self._auto_spam_count[author_id] = spam_count
+            if spam_count >= 5:
                 await self.add_to_blacklist(author_id)
                 del self._auto_spam_count[author_id]
                 await self.log_spammer(ctx, message, retry_after, autoblock=True)
@@ -230,6 +306,24 @@ class beeerbot(commands.Bot):
 
         await self.invoke(ctx)
 
+    async def invoke(self, ctx):
+        # grab the stack of commands that are still running past the threshold,
+        # by the time they finish it is gone
+        handle = None
+        if ctx.command is not None and isinstance(ctx, context.Context):
+            handle = self.loop.call_later(self.slow_command_threshold, ctx.capture_stack, asyncio.current_task())
+
+        start = perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            elapsed = perf_counter() - start
+            if handle is not None:
+                handle.cancel()
+            if ctx.command is not None:
+                metrics.COMMAND_LATENCY.observe(elapsed)
+                self.dispatch('command_timed', ctx, elapsed)
+
     async def on_message(self, message):
         if message.author.bot:
             return
@@ -238,20 +332,30 @@ class beeerbot(commands.Bot):
     async def close(self):
         close_msg = f'Bot shutting down...'
         print(close_msg)
+        # give cogs that buffer writes a chance to persist them
+        for cog in list(self.cogs.values()):
+            flush = getattr(cog, 'flush', None)
+            if flush is None:
+                continue
+            try:
+                await flush()
+            except Exception:
+                log.exception('Failed to flush %s on shutdown', cog.qualified_name)
+        for config in (self.prefixes, self.blacklist):
+            try:
+                await config.flush()
+            except Exception:
+                log.exception('Failed to flush %s on shutdown', config.name)
         wh = self.stats_webhook
         await wh.send(close_msg)
         await super().close()
         await self.session.close()
+        await database.close()
 
     def run(self):
         try:
             super().run(self.config.discord.token, reconnect=True)
         finally:
-            with open('prev_events.log', 'w', encoding='utf-8') as f:
-                for data in self._prev_events:
-                    try:
-                        x = json.dumps(data, ensure_ascii=True, indent=4)
-                    except:
-                        f.write(f'{data}\n')
-                    else:
-                        f.write(f'{x}\n')
+            if self.gateway_events is not None:
+                with open('prev_events.bin', 'wb') as f:
+                    self.gateway_events.dump(f)
@@ -1,33 +1,30 @@
 import asyncio
+from bisect import bisect_left, insort
 from collections import defaultdict
+from collections.abc import Sequence
 from datetime import datetime
+import heapq
 import logging
-import operator
 import random
-from threading import Lock
-from time import sleep, time
-from typing import Dict, List, NamedTuple, TypeVar, Union
+from time import perf_counter, time
+from typing import Dict, List, Tuple, TypeVar, Union
 
 import discord
 from discord.ext import tasks, commands
 from munch import munchify
 import yaml
 
-from sqlalchemy import Column, String, Boolean, Integer, insert, delete, select, update, desc, and_
+from sqlalchemy import Column, Index, String, Boolean, Integer, insert, delete, select, update, and_, func
 from util import database
+from util.metrics import DUCKS, LISTENER_LATENCY
 
 from cogs.utils.formatting import pluralize_auto
 from cogs.utils.func_utils import call_with_args
 from cogs.utils import checks
+from cogs.utils.cache import ExpiringMap
 from cogs.utils.paginator import SimplePages
 
-
-class ScoreEntry(NamedTuple):
-    network: str
-    name: str
-    chan: str
-    shot: int = 0
-    befriend: int = 0
+_listener_latency = LISTENER_LATENCY.labels('duckhunt')
 
 
 class ScoreType:
@@ -47,6 +44,11 @@ class DuckHuntTable(database.base):
     befriend = Column(Integer())
     chan = Column(String(), primary_key=True)
 
+    # lookups by (network, name) are served by the primary key, which leads with those columns
+    __table_args__ = (
+        Index("ix_duck_hunt_network_chan", "network", "chan"),
+    )
+
 
 class NoHuntTable(database.base):
     __tablename__ = "nohunt"
@@ -62,13 +64,39 @@ class StatusTable(database.base):
     duck_kick = Column(Boolean())
 
 
+class DuckSettings:
+    """
+    The duckhunt_options thresholds, shared by the cog and every ChannelState
+    """
+
+    __slots__ = ("min_lines", "min_users", "min_ducktime", "max_ducktime", "test_channel")
+
+    def __init__(self, options):
+        self.update(options)
+
+    def update(self, options):
+        """Applies new duckhunt_options in place, so existing channels pick them up"""
+        self.min_lines = options.get("min_lines", 10)
+        self.min_users = options.get("min_users", 5)
+        self.min_ducktime = options.get("min_ducktime", 480)
+        self.max_ducktime = options.get("max_ducktime", 3600)
+        self.test_channel = options.get("test_channel", 0)
+
+
 class ChannelState:
     """
     Represents the state of the hunt in a single channel
     """
 
-    def __init__(self):
-        self.masks = []
+    __slots__ = (
+        "settings", "masks", "messages", "game_on", "no_duck_kick", "duck_status",
+        "next_duck_time", "duck_time", "shoot_time", "duck_msg_id", "duck_due",
+    )
+
+    def __init__(self, settings: DuckSettings):
+        self.settings = settings
+        # unique speakers, only tracked until min_users is reached
+        self.masks = set()
         self.messages = 0
         self.game_on = False
         self.no_duck_kick = False
@@ -77,7 +105,8 @@ class ChannelState:
         self.duck_time = 0
         self.shoot_time = 0
         self.duck_msg_id = 0
-        self.config = munchify(yaml.safe_load(open("config.yml")))
+        # set once next_duck_time has passed, the duck then waits on channel activity
+        self.duck_due = False
 
     def clear_messages(self):
         self.messages = 0
@@ -85,23 +114,175 @@ class ChannelState:
 
     def should_deploy(self, chan):
         """Should we deploy a duck?"""
-        msg_delay = self.config.duckhunt_options.get("min_lines", 10)
-        mask_req = self.config.duckhunt_options.get("min_users", 5)
-        test_chan = self.config.duckhunt_options.get("test_channel", 0)
+        settings = self.settings
+        test_chan = settings.test_channel
 
         return (
             self.game_on
             and self.duck_status == 0
             and self.next_duck_time <= time()
-            and (self.messages >= msg_delay or chan == test_chan)
-            and (len(self.masks) >= mask_req or chan == test_chan)
+            and (self.messages >= settings.min_lines or chan == test_chan)
+            and (len(self.masks) >= settings.min_users or chan == test_chan)
         )
 
     def handle_message(self, author_id):
         if self.game_on and self.duck_status == 0:
             self.messages += 1
-            if author_id not in self.masks:
-                self.masks.append(author_id)
+            masks = self.masks
+            if len(masks) < self.settings.min_users:
+                masks.add(author_id)
+
+
+ScoreKey = Tuple[str, str, str]
+
+
+class ScoreBuffer:
+    """
+    Score changes that have not been written to the database yet,
+    keyed by (network, chan, name)
+    """
+
+    def __init__(self):
+        self.pending: Dict[ScoreKey, List[int]] = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    @staticmethod
+    def make_key(guild_id, channel_id, name) -> ScoreKey:
+        return str(guild_id), str(channel_id), name
+
+    def add(self, key: ScoreKey, shoot=0, friend=0):
+        delta = self.pending.get(key)
+        if delta is None:
+            self.pending[key] = [shoot, friend]
+        else:
+            delta[0] += shoot
+            delta[1] += friend
+
+    def get(self, key: ScoreKey) -> List[int]:
+        return self.pending.get(key, [0, 0])
+
+    def take(self) -> Dict[ScoreKey, List[int]]:
+        batch, self.pending = self.pending, {}
+        return batch
+
+    def restore(self, batch: Dict[ScoreKey, List[int]]):
+        """Puts back a batch that failed to write"""
+        for key, (shoot, friend) in batch.items():
+            self.add(key, shoot, friend)
+
+    def channel_deltas(self, network: str, name: str = None) -> Dict[str, List[int]]:
+        """Pending changes in ``network`` summed per channel, only for ``name`` if given"""
+        deltas: Dict[str, List[int]] = {}
+        for (key_network, chan, key_name), (shoot, friend) in self.pending.items():
+            if key_network != network or (name is not None and key_name != name):
+                continue
+            delta = deltas.setdefault(chan, [0, 0])
+            delta[0] += shoot
+            delta[1] += friend
+        return deltas
+
+
+class Leaderboard(Sequence):
+    """
+    Non-zero scores ranked highest first, kept in order as they change.
+    Indexing yields "name: score" lines so it can be paginated directly.
+    """
+
+    __slots__ = ("scores", "ranked")
+
+    def __init__(self):
+        self.scores: Dict[str, int] = {}
+        # (-score, name) in ascending order
+        self.ranked: List[Tuple[int, str]] = []
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [f"{name}: {-score}" for score, name in self.ranked[item]]
+        score, name = self.ranked[item]
+        return f"{name}: {-score}"
+
+    def get(self, name) -> int:
+        return self.scores.get(name, 0)
+
+    def set(self, name, score: int):
+        old = self.scores.get(name, 0)
+        if old == score:
+            return
+
+        if old:
+            del self.ranked[bisect_left(self.ranked, (-old, name))]
+        if score:
+            insort(self.ranked, (-score, name))
+            self.scores[name] = score
+        else:
+            del self.scores[name]
+
+    def add(self, name, delta: int) -> int:
+        score = self.scores.get(name, 0) + delta
+        self.set(name, score)
+        return score
+
+    def top(self, count=None) -> List[Tuple[str, int]]:
+        return [(name, -score) for score, name in self.ranked[:count]]
+
+
+class ScoreIndex:
+    """
+    Every duck_hunt score held in memory, ranked per channel and per guild.
+    Built from the database at startup and updated in place on every hit.
+    """
+
+    columns = ("shot", "befriend")
+
+    def __init__(self):
+        # column -> (network, chan) -> board
+        self.channels: Dict[str, Dict[Tuple[str, str], Leaderboard]] = {c: defaultdict(Leaderboard) for c in self.columns}
+        # column -> network -> board of totals across channels
+        self.totals: Dict[str, Dict[str, Leaderboard]] = {c: defaultdict(Leaderboard) for c in self.columns}
+        # column -> network -> board of totals divided by the channels scored in
+        self.averages: Dict[str, Dict[str, Leaderboard]] = {c: defaultdict(Leaderboard) for c in self.columns}
+        # column -> (network, name) -> channels with a non-zero score
+        self.chancount: Dict[str, Dict[Tuple[str, str], int]] = {c: defaultdict(int) for c in self.columns}
+
+    def add(self, network: str, chan: str, name: str, shot=0, befriend=0):
+        for column, delta in zip(self.columns, (shot, befriend)):
+            if delta:
+                self._add(column, network, chan, name, delta)
+
+    def _add(self, column, network, chan, name, delta):
+        board = self.channels[column][(network, chan)]
+        old = board.get(name)
+        new = board.add(name, delta)
+
+        count_key = (network, name)
+        chancount = self.chancount[column]
+        if not old and new:
+            chancount[count_key] += 1
+        elif old and not new:
+            chancount[count_key] -= 1
+
+        total = self.totals[column][network].add(name, delta)
+        count = chancount[count_key]
+        self.averages[column][network].set(name, int(total / count) if count else 0)
+        if not count:
+            del chancount[count_key]
+
+    def get(self, network: str, chan: str, name: str) -> Tuple[int, int]:
+        return tuple(self.channels[column][(network, chan)].get(name) for column in self.columns)
+
+    def channel_board(self, column, network, chan) -> Leaderboard:
+        return self.channels[column].get((network, chan)) or Leaderboard()
+
+    def total_board(self, column, network) -> Leaderboard:
+        return self.totals[column].get(network) or Leaderboard()
+
+    def average_board(self, column, network) -> Leaderboard:
+        return self.averages[column].get(network) or Leaderboard()
 
 
 class Duckhunt(commands.Cog):
@@ -117,9 +298,7 @@ class Duckhunt(commands.Cog):
         self.delete_source_msg = False
 
         # Grab config options
-        self.min_ducktime = self.config.duckhunt_options.get("min_ducktime", 480)
-        self.max_ducktime = self.config.duckhunt_options.get("max_ducktime", 3600)
-        self.test_channel_id = self.config.duckhunt_options.get("test_channel", 0)
+        self.settings = DuckSettings(self.config.duckhunt_options)
 
         # Set up duck parts
         self.duck_tail = "・゜゜・。。・゜゜"
@@ -148,18 +327,29 @@ class Duckhunt(commands.Cog):
         # Set up game status
         self.T = TypeVar("T")
         self.ConnMap = Dict[int, Dict[int, self.T]]
-        self.scripters: Dict[int, float] = defaultdict(float)
+        # user id: end of their cooldown, entries drop out once it has passed
+        self.scripters = ExpiringMap(7200.0, clock=time)
         self.chan_locks: ConnMap[asyncio.Lock] = defaultdict(lambda: defaultdict(asyncio.Lock))
         self.game_status: ConnMap[ChannelState] = defaultdict(
-            lambda: defaultdict(ChannelState)
+            lambda: defaultdict(lambda: ChannelState(self.settings))
         )
         self.opt_out: Dict[int, List[int]] = defaultdict(list)
+        # heap of (next_duck_time, guild_id, channel_id), stale entries are skipped when popped
+        self.duck_timers: List[Tuple[int, int, int]] = []
+        self.duck_timer_wakeup = asyncio.Event()
+        self.score_buffer = ScoreBuffer()
+        self.score_index = ScoreIndex()
+        self.flush_lock = asyncio.Lock()
 
         self.load_optout()
+        self.load_scores()
 
         # Start event loops
         self.save_status.start()
         self.deploy_duck.start()
+        flush_interval = self.config.duckhunt_options.get("score_flush_interval", 30)
+        self.flush_score_buffer.change_interval(seconds=flush_interval)
+        self.flush_score_buffer.start()
 
         # Set up duck times for all channels
         try:
@@ -191,6 +381,14 @@ class Duckhunt(commands.Cog):
         self.opt_out.clear()
         self.opt_out.update(new_data)
 
+    def load_scores(self):
+        """Builds the in-memory leaderboards, this is the only full read of duck_hunt"""
+        rows = self.db.execute(
+            select(self.table.network, self.table.chan, self.table.name, self.table.shot, self.table.befriend)
+        ).fetchall()
+        for row in rows:
+            self.score_index.add(row.network, row.chan, row.name, row.shot or 0, row.befriend or 0)
+
     def load_status(self):
         rows = self.db.execute(select(self.status_table)).scalars().all()
         for row in rows:
@@ -208,58 +406,97 @@ class Duckhunt(commands.Cog):
     def set_ducktime(self, channel_id, guild_id):
         status = self.get_state_table(guild_id, channel_id)  # type: ChannelState
         # Artificially set next_duck_time low for testing purposes
-        if self.test_channel_id == channel_id:
+        if self.settings.test_channel == channel_id:
             status.next_duck_time = int(time()) + 30
         else:
             status.next_duck_time = random.randint(
-                int(time()) + self.min_ducktime, int(time()) + self.max_ducktime
+                int(time()) + self.settings.min_ducktime, int(time()) + self.settings.max_ducktime
             )
         status.duck_status = 0
+        status.duck_due = False
         # let's also reset the number of messages said and the list of masks that have spoken.
         status.clear_messages()
+
+        timer = (status.next_duck_time, guild_id, channel_id)
+        heapq.heappush(self.duck_timers, timer)
+        if self.duck_timers[0] is timer:
+            # the scheduler is sleeping on a later timer
+            self.duck_timer_wakeup.set()
         return
 
-    def save_channel_state(self, guild_id: int, channel_id: int, status=None):
+    def _save_channel_state(self, session, guild_id: int, channel_id: int, active: bool, duck_kick: bool):
+        database.upsert(
+            session,
+            self.status_table,
+            [{"network": str(guild_id), "chan": str(channel_id), "active": active, "duck_kick": duck_kick}],
+            index_elements=("network", "chan"),
+            replace=("active", "duck_kick"),
+        )
+        session.commit()
+
+    async def save_channel_state(self, guild_id: int, channel_id: int, status=None):
         if status is None:
             status = self.get_state_table(guild_id, channel_id)
 
-        active = status.game_on
-        duck_kick = status.no_duck_kick
-        res = self.db.execute(
-            update(self.status_table)
-            .where(
-                and_(self.status_table.network == guild_id, self.status_table.chan == channel_id)
-            )
-            .values(active=active, duck_kick=duck_kick)
+        await database.run(
+            self._save_channel_state, guild_id, channel_id, status.game_on, status.no_duck_kick
         )
 
-        if not res.rowcount:
-            self.db.execute(
-                insert(self.status_table).values(
-                    network=guild_id, chan=channel_id, active=active, duck_kick=duck_kick
-                )
-            )
-
-        self.db.commit()
-
     def cog_unload(self):
         # Stop event loops
         self.save_status.cancel()
         self.deploy_duck.cancel()
+        self.flush_score_buffer.cancel()
         # save_status is a coroutine but cog_unload CANNOT be a coroutine
         # so we create an asyncio task instead
         self.bot.loop.create_task(self.save_status(_sleep=False))
+        self.bot.loop.create_task(self.flush_scores())
+
+    async def flush(self):
+        """Called by the bot on shutdown to write out anything still buffered"""
+        await self.flush_scores()
+
+    def _write_scores(self, session, batch):
+        rows = [
+            {"network": network, "chan": chan, "name": name, "shot": shoot, "befriend": friend}
+            for (network, chan, name), (shoot, friend) in batch.items()
+        ]
+        database.upsert(
+            session,
+            self.table,
+            rows,
+            index_elements=("network", "name", "chan"),
+            increment=("shot", "befriend"),
+        )
+        session.commit()
+
+    async def flush_scores(self):
+        """Writes all buffered score changes in a single transaction"""
+        async with self.flush_lock:
+            batch = self.score_buffer.take()
+            if not batch:
+                return
+
+            try:
+                await database.run(self._write_scores, batch)
+            except Exception:
+                self.score_buffer.restore(batch)
+                self.log.error('Failed to flush %d duck scores', len(batch), exc_info=True)
+
+    @tasks.loop(seconds=30)
+    async def flush_score_buffer(self):
+        await self.flush_scores()
 
     @tasks.loop(hours=8)
     async def save_status(self, _sleep=True):
-        for network in self.game_status:
-            for chan, status in self.game_status[network].items():
-                self.save_channel_state(network, chan, status)
+        for network in list(self.game_status):
+            for chan, status in list(self.game_status[network].items()):
+                await self.save_channel_state(network, chan, status)
 
                 if _sleep:
                     await asyncio.sleep(10)
 
-    def set_game_state(self, guild_id, channel_id, active=None, duck_kick=None):
+    async def set_game_state(self, guild_id, channel_id, active=None, duck_kick=None):
         status = self.get_state_table(guild_id, channel_id)
         if active is not None:
             status.game_on = active
@@ -267,7 +504,7 @@ class Duckhunt(commands.Cog):
         if duck_kick is not None:
             status.no_duck_kick = duck_kick
 
-        self.save_channel_state(guild_id, channel_id, status)
+        await self.save_channel_state(guild_id, channel_id, status)
 
     def is_opt_out(self, guild_id: int, channel_id: int):
         if not guild_id or guild_id == 0:
@@ -277,14 +514,29 @@ class Duckhunt(commands.Cog):
     @commands.Cog.listener('on_message')
     async def increment_msg_counter(self, msg):
         """Increment the number of messages said in an active game channel. Also keep track of the unique masks that are speaking."""
+        start = perf_counter()
         guild_id = getattr(msg.guild, 'id', 0)
         channel_id = getattr(msg.channel, 'id', 0)
         author_id = getattr(msg.author, 'id', 0)
 
-        if self.is_opt_out(guild_id, channel_id):
-            return
+        if not self.is_opt_out(guild_id, channel_id):
+            status = self.get_state_table(guild_id, channel_id)
+            status.handle_message(author_id)
+            if status.duck_due and status.should_deploy(channel_id):
+                await self.deploy(channel_id, status)
+
+        _listener_latency.observe(perf_counter() - start)
+
+    @commands.command(aliases=["duckreload"], hidden=True)
+    @commands.is_owner()
+    async def reload_duck_config(self, ctx):
+        """- Re-reads duckhunt_options from config.yml."""
+        with open("config.yml") as f:
+            config = munchify(yaml.safe_load(f))
 
-        self.get_state_table(guild_id, channel_id).handle_message(author_id)
+        self.config.duckhunt_options = config.duckhunt_options
+        self.settings.update(config.duckhunt_options)
+        await self.ctx_send(ctx, "Duckhunt settings reloaded.", source_delay=10)
 
     @commands.command(aliases=["starthunt"])
     @checks.is_mod()
@@ -305,7 +557,7 @@ class Duckhunt(commands.Cog):
             out = f"There is already a game running in {channel_name}."
             return await self.ctx_send(ctx, out, delete_delay=5)
 
-        self.set_game_state(guild_id, channel_id, active=True)
+        await self.set_game_state(guild_id, channel_id, active=True)
         self.set_ducktime(channel_id, guild_id)
         await ctx.send(
             "Ducks have been spotted nearby. "
@@ -326,7 +578,7 @@ class Duckhunt(commands.Cog):
             return
 
         if self.get_state_table(guild_id, channel_id).game_on:
-            self.set_game_state(guild_id, channel_id, active=False)
+            await self.set_game_state(guild_id, channel_id, active=False)
             out = "The game has been stopped."
             await self.ctx_send(ctx, out, delete_delay=20, source_delay=10)
         else:
@@ -347,13 +599,13 @@ class Duckhunt(commands.Cog):
             return
 
         if text.lower() == "enable":
-            self.set_game_state(guild_id, channel_id, duck_kick=True)
+            await self.set_game_state(guild_id, channel_id, duck_kick=True)
             out = "Users will now be muted for shooting or befriending non-existent ducks. The bot needs to have " \
                 "appropriate flags to be able to mute users for this to work."
             return await self.ctx_send(ctx, out, delete_delay=20, source_delay=10)
 
         if text.lower() == "disable":
-            self.set_game_state(guild_id, channel_id, duck_kick=False)
+            await self.set_game_state(guild_id, channel_id, duck_kick=False)
             out = "Muting for non-existent ducks has been disabled."
             return await self.ctx_send(ctx, out, delete_delay=20, source_delay=10)
 
@@ -378,30 +630,56 @@ class Duckhunt(commands.Cog):
             dnoise = dnoise[:rn] + "\u200b" + dnoise[rn:]
         return (dtail, dbody, dnoise)
 
-    @tasks.loop(seconds=10.0)
+    @tasks.loop(seconds=0.0)
     async def deploy_duck(self):
-        for network in self.game_status:
-            for chan in self.game_status[network]:
-                status = self.get_state_table(network, chan)
-                channel = self.bot.get_channel(chan)
-                if not status.should_deploy(chan) or not channel:
-                    continue
-
-                # deploy a duck to channel
-                try:
-                    status.duck_status = 1
-                    status.duck_time = time()
-                    dtail, dbody, dnoise = self.generate_duck()
-                    em = discord.Embed(
-                        title="A duck has appeared!",
-                        description=f"{dtail}{dbody}{dnoise}",
-                        color=469033)
-                    em.set_thumbnail(url="https://i.imgur.com/nvsLpzo.png")
-                    duck_msg = await channel.send(embed=em)
-                    status.duck_msg_id = duck_msg.id
-                    self.log.info(f"deploying duck to {channel.name}")
-                except:
-                    self.log.error(f"error deploying duck to {chan}", exc_info=True)
+        """Sleeps until the earliest duck timer expires, then handles the channels that are due"""
+        self.duck_timer_wakeup.clear()
+        if not self.duck_timers:
+            await self.duck_timer_wakeup.wait()
+            return
+
+        delay = self.duck_timers[0][0] - time()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(self.duck_timer_wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        now = time()
+        while self.duck_timers and self.duck_timers[0][0] <= now:
+            due, guild_id, channel_id = heapq.heappop(self.duck_timers)
+            status = self.game_status.get(guild_id, {}).get(channel_id)
+            if status is None or status.next_duck_time != due or not status.game_on or status.duck_status != 0:
+                continue
+
+            # from here on increment_msg_counter deploys once the channel is busy enough
+            status.duck_due = True
+            if status.should_deploy(channel_id):
+                await self.deploy(channel_id, status)
+
+    async def deploy(self, chan, status):
+        channel = self.bot.get_channel(chan)
+        if not channel:
+            return
+
+        # deploy a duck to channel
+        DUCKS.inc()
+        try:
+            status.duck_status = 1
+            status.duck_due = False
+            status.duck_time = time()
+            dtail, dbody, dnoise = self.generate_duck()
+            em = discord.Embed(
+                title="A duck has appeared!",
+                description=f"{dtail}{dbody}{dnoise}",
+                color=469033)
+            em.set_thumbnail(url="https://i.imgur.com/nvsLpzo.png")
+            duck_msg = await channel.send(embed=em)
+            status.duck_msg_id = duck_msg.id
+            self.log.info(f"deploying duck to {channel.name}")
+        except:
+            self.log.error(f"error deploying duck to {chan}", exc_info=True)
 
     def hit_or_miss(self, deploy: int, shoot: int):
         """This function calculates if the befriend or bang will be successful."""
@@ -414,7 +692,7 @@ class Duckhunt(commands.Cog):
 
         return 1
 
-    def dbadd_entry(self, nick, channel_id: str, guild_id: str, shoot: int, friend: int):
+    def dbadd_entry(self, session, nick, channel_id: str, guild_id: str, shoot: int, friend: int):
         """Takes care of adding a new row to the database."""
         stmt = insert(self.table).values(
             network=guild_id,
@@ -423,10 +701,9 @@ class Duckhunt(commands.Cog):
             shot=shoot,
             befriend=friend
         )
-        self.db.execute(stmt)
-        self.db.commit()
+        session.execute(stmt)
 
-    def dbupdate(self, nick, channel_id: str, guild_id: str, shoot: int, friend: int):
+    def dbupdate(self, session, nick, channel_id: str, guild_id: str, shoot: int, friend: int):
         """update a db row"""
         values = {}
         if shoot:
@@ -450,23 +727,15 @@ class Duckhunt(commands.Cog):
             .values(**values)
         )
 
-        self.db.execute(query)
-        self.db.commit()
+        session.execute(query)
 
     def update_score(self, nick, channel_id: str, guild_id: str, shoot=0, friend=0):
-        score = self.db.execute(
-            select([self.table.shot, self.table.befriend])
-            .where(self.table.network == guild_id)
-            .where(self.table.chan == channel_id)
-            .where(self.table.name == nick)
-        ).fetchone()
-
-        if score:
-            self.dbupdate(nick, channel_id, guild_id, score[0] + shoot, score[1] + friend)
-            return {"shoot": score[0] + shoot, "friend": score[1] + friend}
-
-        self.dbadd_entry(nick, channel_id, guild_id, shoot, friend)
-        return {"shoot": shoot, "friend": friend}
+        """Buffers a score change and returns the new totals, the write happens on the next flush"""
+        key = self.score_buffer.make_key(guild_id, channel_id, nick)
+        self.score_buffer.add(key, shoot, friend)
+        self.score_index.add(*key, shot=shoot, befriend=friend)
+        shot, befriend = self.score_index.get(*key)
+        return {"shoot": shot, "friend": befriend}
 
     async def attack(self, ctx, author: discord.Member, channel_id: str, channel_name: str, guild_id: str, attack_type: str):
         if self.is_opt_out(guild_id, channel_id):
@@ -537,13 +806,13 @@ class Duckhunt(commands.Cog):
         # Did the attacker miss?
         if not random.random() <= chance and chance > 0.05:
             out = random.choice(miss) + " You can try again in 7 seconds."
-            self.scripters[author.id] = shoot + 7
+            self.scripters.set(author.id, shoot + 7, expires=shoot + 7)
             return await self.ctx_send(ctx, out, source_delay=10)
 
         # Is someone cheating? (Add to scripters list)
         if chance == 0.05:
             out += scripter_msg.format(shoot - deploy)
-            self.scripters[author.id] = shoot + 7200
+            self.scripters.set(author.id, shoot + 7200, expires=shoot + 7200)
             out = random.choice(miss) + " " + out
             return await self.ctx_send(ctx, out, delete_delay=20, source_delay=10)
 
@@ -626,69 +895,20 @@ class Duckhunt(commands.Cog):
         async with self.chan_locks[guild_id][channel_id]:
             return await self.attack(ctx, ctx.author, channel_id, channel_name, guild_id, "befriend")
 
-    def top_list(self, prefix, data, join_char=" • "):
-        sorted_data = sorted(data, key=operator.itemgetter(1), reverse=True)
-
-        reply_text: List[str] = []
-        for k,v in sorted_data:
-            reply_text.append(f"{k}: {v}")
-        return SimplePages(entries=reply_text, per_page=15)
-
-    def get_scores(self, score_type, guild_id, channel_id=None):
-        clause = self.table.network == guild_id
-        if channel_id is not None:
-            clause = and_(clause, self.table.chan == channel_id)
-        query_column = getattr(self.table, score_type)
-        query = select(self.table.name, query_column).where(clause).order_by(
-            desc(query_column)
-        )
-
-        scores = self.db.execute(query).fetchall()
-        return scores
+    def top_list(self, title, data: Leaderboard):
+        # the board is already ranked and formats only the rows of the page shown
+        pages = SimplePages(entries=data, per_page=15)
+        pages.embed.title = title
+        return pages
 
     def get_channel_scores(self, score_type: ScoreType, guild_id, channel_id):
-        scores_dict: Dict[str, int] = defaultdict(int)
-        scores = self.get_scores(score_type.column_name, guild_id, channel_id)
-
-        if not scores:
-            return None
-
-        for row in scores:
-            if row[1] == 0:
-                continue
-
-            scores_dict[row[0]] += row[1]
-
-        return scores_dict
-
-    def _get_global_scores(self, score_type: ScoreType, guild_id):
-        scores_dict: Dict[str, int] = defaultdict(int)
-        chancount: Dict[str, int] = defaultdict(int)
-        scores = self.get_scores(score_type.column_name, guild_id)
-        if not scores:
-            return None, None
-
-        for row in scores:
-            if row[1] == 0:
-                continue
-
-            chancount[row[0]] += 1
-            scores_dict[row[0]] += row[1]
-
-        return scores_dict, chancount
+        return self.score_index.channel_board(score_type.column_name, str(guild_id), str(channel_id))
 
     def get_global_scores(self, score_type: ScoreType, guild_id):
-        return self._get_global_scores(score_type, guild_id)[0]
+        return self.score_index.total_board(score_type.column_name, str(guild_id))
 
     def get_average_scores(self, score_type: ScoreType, guild_id):
-        scores_dict, chancount = self._get_global_scores(score_type, guild_id)
-        if not scores_dict:
-            return None
-
-        for k, v in scores_dict.items():
-            scores_dict[k] = int(v / chancount[k])
-
-        return scores_dict
+        return self.score_index.average_board(score_type.column_name, str(guild_id))
 
     async def display_scores(self, ctx, score_type: ScoreType, text, channel_id, guild_id):
         channel_name = getattr(ctx.channel, 'name', '')
@@ -696,10 +916,10 @@ class Duckhunt(commands.Cog):
         if self.is_opt_out(guild_id, channel_id):
             return
 
-        global_pfx = "Duck {noun} scores across the network: ".format(
+        global_pfx = "Duck {noun} scores across the network".format(
             noun=score_type.noun
         )
-        chan_pfx = "Duck {noun} scores in {chan}: ".format(
+        chan_pfx = "Duck {noun} scores in #{chan}".format(
             noun=score_type.noun, chan=channel_name
         )
         no_ducks = "It appears no one has {verb} any ducks yet.".format(
@@ -725,7 +945,7 @@ class Duckhunt(commands.Cog):
         if not scores_dict:
             return await self.ctx_send(ctx, no_ducks, source_delay=10)
 
-        pages = self.top_list(out, scores_dict.items())
+        pages = self.top_list(out, scores_dict)
         try:
             await pages.start(ctx)
         except menus.MenuError as e:
@@ -773,7 +993,8 @@ class Duckhunt(commands.Cog):
             )
             return await self.ctx_send(ctx, out, source_delay=10)
 
-        self.scripters[nick.id] = time() + cooldown
+        until = time() + cooldown
+        self.scripters.set(nick.id, until, expires=until)
         out = "{} has been naughty. You put them in a cooldown until {}".format(
             nick.name, datetime.fromtimestamp(self.scripters[nick.id])
         )
@@ -784,7 +1005,7 @@ class Duckhunt(commands.Cog):
     async def duckforgive(self, ctx, nick: discord.Member):
         """<nick> - Allows people to be removed from the mandatory cooldown period."""
         if nick.id in self.scripters and self.scripters[nick.id] > time():
-            self.scripters[nick.id] = 0
+            self.scripters.pop(nick.id, None)
             out = "{} has been removed from the mandatory cooldown period.".format(nick.name)
             return await self.ctx_send(ctx, out, source_delay=10)
 
@@ -839,9 +1060,8 @@ class Duckhunt(commands.Cog):
                 return await self.ctx_send(ctx, out, source_delay=10)
 
             query = insert(self.nohunt_table).values(network=guild_id, chan=channel)
-            self.db.execute(query)
-            self.db.commit()
-            self.load_optout()
+            await database.execute(query)
+            self.opt_out[guild_id].append(channel)
 
             out = "The duckhunt has been successfully disabled in #{}.".format(
                 self.bot.get_channel(channel).name
@@ -854,14 +1074,43 @@ class Duckhunt(commands.Cog):
                 return await self.ctx_send(ctx, out, source_delay=10)
 
             query = delete(self.nohunt_table).where(self.nohunt_table.chan == channel)
-            self.db.execute(query)
-            self.db.commit()
-            self.load_optout()
+            await database.execute(query)
+            for chans in self.opt_out.values():
+                if channel in chans:
+                    chans.remove(channel)
             out = "The duckhunt has been successfully re-enabled in #{}.".format(
                 self.bot.get_channel(channel).name
             )
             return await self.ctx_send(ctx, out, source_delay=10)
 
+    def _merge_scores(self, session, guild_id, oldnick, newnick, duckmerge, channelkey):
+        for channel in channelkey["insert"]:
+            self.dbadd_entry(
+                session,
+                newnick,
+                channel,
+                guild_id,
+                duckmerge[channel]["shot"],
+                duckmerge[channel]["befriend"],
+            )
+
+        for channel in channelkey["update"]:
+            self.dbupdate(
+                session,
+                newnick,
+                channel,
+                guild_id,
+                duckmerge[channel]["shot"],
+                duckmerge[channel]["befriend"],
+            )
+
+        query = delete(self.table).where(
+            and_(self.table.network == guild_id, self.table.name == oldnick)
+        )
+
+        session.execute(query)
+        session.commit()
+
     # @commands.command(aliases=["duckmerge"])
     # @checks.is_mod()
     async def duck_merge(self, ctx, oldnick: Union[discord.Member, str], newnick: Union[discord.Member, str]):
@@ -888,6 +1137,9 @@ class Duckhunt(commands.Cog):
             out = "Please specify two nicks for this command."
             return await self.ctx_send(ctx, out, delete_delay=20, source_delay=10)
 
+        # merge against the table, so write out anything still buffered first
+        await self.flush_scores()
+
         oldnickquery = select(
             self.table.name,
             self.table.chan,
@@ -897,7 +1149,7 @@ class Duckhunt(commands.Cog):
             self.table.network == guild_id,
             self.table.name == oldnick
         )
-        oldnickscore = self.db.execute(oldnickquery).fetchall()
+        oldnickscore = await database.fetchall(oldnickquery)
 
         newnickquery = select(
             self.table.name,
@@ -908,7 +1160,7 @@ class Duckhunt(commands.Cog):
             self.table.network == guild_id,
             self.table.name == newnick
         )
-        newnickscore = self.db.execute(newnickquery).fetchall()
+        newnickscore = await database.fetchall(newnickquery)
 
         duckmerge: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
         total_kills = 0
@@ -940,30 +1192,11 @@ class Duckhunt(commands.Cog):
             else:
                 channelkey["insert"].append(chan_name)
 
-        for channel in channelkey["insert"]:
-            self.dbadd_entry(
-                newnick,
-                channel,
-                guild_id,
-                duckmerge[channel]["shot"],
-                duckmerge[channel]["befriend"],
-            )
-
-        for channel in channelkey["update"]:
-            self.dbupdate(
-                newnick,
-                channel,
-                guild_id,
-                duckmerge[channel]["shot"],
-                duckmerge[channel]["befriend"],
-            )
-
-        query = delete(self.table).where(
-            and_(self.table.network == guild_id, self.table.name == oldnick)
-        )
-
-        self.db.execute(query)
-        self.db.commit()
+        await database.run(self._merge_scores, guild_id, oldnick, newnick, duckmerge, channelkey)
+        for row in oldnickscore:
+            network = str(guild_id)
+            self.score_index.add(network, row.chan, newnick, row.shot, row.befriend)
+            self.score_index.add(network, row.chan, oldnick, -row.shot, -row.befriend)
         out = "Migrated {} and {} from {} to {}".format(
                 pluralize_auto(total_kills, "duck kill"),
                 pluralize_auto(total_friends, "duck friend"),
@@ -972,6 +1205,47 @@ class Duckhunt(commands.Cog):
             )
         await self.ctx_send(ctx, out, delete_delay=20, source_delay=10)
 
+    def _user_scores(self, session, network, name):
+        table = self.table
+        return session.execute(
+            select(table.chan, table.shot, table.befriend).where(table.network == network, table.name == name)
+        ).all()
+
+    def _guild_scores(self, session, network):
+        table = self.table
+        return session.execute(
+            select(
+                table.chan,
+                func.coalesce(func.sum(table.shot), 0),
+                func.coalesce(func.sum(table.befriend), 0),
+            ).where(table.network == network).group_by(table.chan)
+        ).all()
+
+    async def channel_scores(self, guild_id, name=None) -> Dict[str, List[int]]:
+        """
+        (shot, befriend) per channel of a guild, for one name or summed over
+        everyone, from the table plus the changes that are still buffered
+        """
+        network = str(guild_id)
+        # held so a flush can't move a batch from the buffer to the table halfway through
+        async with self.flush_lock:
+            if name is None:
+                rows = await database.run(self._guild_scores, network)
+            else:
+                rows = await database.run(self._user_scores, network, name)
+            deltas = self.score_buffer.channel_deltas(network, name)
+
+        scores = {chan: [shot or 0, befriend or 0] for chan, shot, befriend in rows}
+        for chan, (shoot, friend) in deltas.items():
+            score = scores.setdefault(chan, [0, 0])
+            score[0] += shoot
+            score[1] += friend
+        return scores
+
+    def get_channel_name(self, chan):
+        channel = self.bot.get_channel(int(chan))
+        return channel.name if channel else f"deleted-channel-{chan}"
+
     @commands.command(aliases=["ducks"])
     async def ducks_user(self, ctx, *, text=""):
         """<nick> - Prints a users duck stats. If no nick is input it will check the calling username."""
@@ -984,57 +1258,42 @@ class Duckhunt(commands.Cog):
         if text:
             name = text.split()[0].lower()
 
-        ducks: Dict[str, int] = defaultdict(int)
-        scores = self.db.execute(
-            select(
-                self.table.name, self.table.chan, self.table.shot, self.table.befriend
-            ).where(
-                and_(
-                    self.table.network == guild_id,
-                    self.table.name == name,
-                ),
-            )
-        ).fetchall()
+        scores = await self.channel_scores(guild_id, name)
+        chans = len(scores)
+        killed = sum(shot for shot, _ in scores.values())
+        friends = sum(befriend for _, befriend in scores.values())
+        chan_score = scores.get(str(channel_id))
 
         if text:
             name = text.split()[0]
         else:
             name = nick
 
-        if scores:
-            has_hunted_in_chan = False
-            for row in scores:
-                if row.chan == channel_id:
-                    has_hunted_in_chan = True
-                    ducks["chankilled"] += row.shot
-                    ducks["chanfriends"] += row.befriend
-
-                ducks["killed"] += row.shot
-                ducks["friend"] += row.befriend
-                ducks["chans"] += 1
+        if chans:
+            chankilled, chanfriends = chan_score or (0, 0)
 
             # Check if the user has only participated in the hunt in this channel
-            if ducks["chans"] == 1 and has_hunted_in_chan:
+            if chans == 1 and chan_score:
                 out = "**{}** has killed {} and befriended {} in *#{}*.".format(
                     name,
-                    pluralize_auto(ducks["chankilled"], "duck"),
-                    pluralize_auto(ducks["chanfriends"], "duck"),
+                    pluralize_auto(chankilled, "duck"),
+                    pluralize_auto(chanfriends, "duck"),
                     channel_name,
                     )
                 return await self.ctx_send(ctx, out, delete_delay=60, source_delay=10)
 
-            kill_average = int(ducks["killed"] / ducks["chans"])
-            friend_average = int(ducks["friend"] / ducks["chans"])
+            kill_average = int(killed / chans)
+            friend_average = int(friends / chans)
             out = "**{}'s** duck stats: {} killed and {} befriended in *#{}*. " \
                 "Across {}: {} killed and {} befriended. " \
                 "Averaging {} and {} per channel.".format(
                     name,
-                    pluralize_auto(ducks["chankilled"], "duck"),
-                    pluralize_auto(ducks["chanfriends"], "duck"),
+                    pluralize_auto(chankilled, "duck"),
+                    pluralize_auto(chanfriends, "duck"),
                     channel_name,
-                    pluralize_auto(ducks["chans"], "channel"),
-                    pluralize_auto(ducks["killed"], "duck"),
-                    pluralize_auto(ducks["friend"], "duck"),
+                    pluralize_auto(chans, "channel"),
+                    pluralize_auto(killed, "duck"),
+                    pluralize_auto(friends, "duck"),
                     pluralize_auto(kill_average, "kill"),
                     pluralize_auto(friend_average, "friend"),
                 )
@@ -1050,52 +1309,27 @@ class Duckhunt(commands.Cog):
         channel_id = getattr(ctx.channel, 'id', 0)
         channel_name = getattr(ctx.channel, 'name', 0)
 
-        scores = self.db.execute(
-            select(
-                self.table.name, self.table.chan, self.table.shot, self.table.befriend
-            ).where(self.table.network == guild_id)
-        ).fetchall()
-        friend_chan: Dict[str, int] = defaultdict(int)
-        kill_chan: Dict[str, int] = defaultdict(int)
-        chan_killed = 0
-        chan_friends = 0
-        killed = 0
-        friends = 0
-        chans = set()
-
-        if scores:
-            for row in scores:
-                chan_name = self.bot.get_channel(int(row.chan)).name
-                chans.add(chan_name)
-                friend_chan[chan_name] += row.befriend
-                kill_chan[chan_name] += row.shot
-                if chan_name.lower() == channel_name.lower():
-                    chan_killed += row.shot
-                    chan_friends += row.befriend
-
-                killed += row.shot
-                friends += row.befriend
-
-            killerchan, killscore = sorted(
-                kill_chan.items(), key=operator.itemgetter(1), reverse=True
-            )[0]
-            friendchan, friendscore = sorted(
-                friend_chan.items(),
-                key=operator.itemgetter(1),
-                reverse=True,
-            )[0]
+        scores = await self.channel_scores(guild_id)
+        chans = len(scores)
+        killed = sum(shot for shot, _ in scores.values())
+        friends = sum(befriend for _, befriend in scores.values())
+
+        if chans:
+            chan_killed, chan_friends = scores.get(str(channel_id), (0, 0))
+            killerchan, (killscore, _) = max(scores.items(), key=lambda item: item[1][0])
+            friendchan, (_, friendscore) = max(scores.items(), key=lambda item: item[1][1])
             out = "**Duck Stats:** {:,} killed and {:,} befriended in *#{}*. " \
                 "Across {} {:,} ducks have been killed and {:,} befriended. " \
                 "**Top Channels:** *#{}* with {} and *#{}* with {}".format(
                     chan_killed,
                     chan_friends,
                     channel_name,
-                    pluralize_auto(len(chans), "channel"),
+                    pluralize_auto(chans, "channel"),
                     killed,
                     friends,
-                    killerchan,
+                    self.get_channel_name(killerchan),
                     pluralize_auto(killscore, "kill"),
-                    friendchan,
+                    self.get_channel_name(friendchan),
                     pluralize_auto(friendscore, "friend"),
                 )
             return await self.ctx_send(ctx, out, delete_delay=300, source_delay=10)
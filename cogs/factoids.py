@@ -1,16 +1,31 @@
-from collections import defaultdict
+import asyncio
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+import difflib
+from itertools import islice, takewhile
 import logging
+import re
 import string
-from typing import Dict, List
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
 import discord
 from discord import utils
 from discord.ext import commands, menus
 from sqlalchemy import Column, String, insert, delete, select, update, and_
 
 from util import database
+from util.metrics import FACTOIDS, LISTENER_LATENCY
 from cogs.utils.formatting import get_text_list
 from cogs.utils import checks
-from cogs.utils.paginator import RoboPages, SimplePages, TextPageSource
+from cogs.utils.paginator import IterTextPageSource, LazySimplePages, RoboPages, SimplePages
+
+_listener_latency = LISTENER_LATENCY.labels('factoids')
+
+# "did you mean" suggestions only compare names of a similar length that share
+# the first letters of the missed word, and at most this many of them
+SUGGEST_MIN_LENGTH = 3
+SUGGEST_PREFIX_LENGTH = 2
+SUGGEST_CANDIDATES = 50
 
 
 # below is the default factoid in every channel you can modify it however you like
@@ -24,14 +39,230 @@ class FactoidsTable(database.base):
     chan = Column(String(65), primary_key=True)
 
 
+def _first_arg(message, args):
+    return args[0] if args else None
+
+
+def _second_arg(message, args):
+    return args[1] if len(args) > 1 else None
+
+
+def _author_name(message, args):
+    return getattr(message.author, 'display_name', None)
+
+
+def _channel_name(message, args):
+    return getattr(message.channel, 'name', None)
+
+
+# <placeholder> -> resolver(message, args), add an entry here to support a new placeholder
+placeholders = {
+    "user": _first_arg,
+    "arg2": _second_arg,
+    "nick": _author_name,
+    "channel": _channel_name,
+}
+
+
+class FactoidTemplate:
+    """
+    A factoid's data parsed once into literal text and placeholder slots
+    """
+
+    __slots__ = ("raw", "act", "parts", "slots")
+
+    pattern = re.compile("<({})>".format("|".join(map(re.escape, placeholders))))
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.act = raw.startswith("<act>")
+        body = raw[5:].strip() if self.act else raw
+        # literal text at even indexes, placeholder names at odd ones
+        self.parts: Tuple[str, ...] = tuple(self.pattern.split(body))
+        self.slots: FrozenSet[str] = frozenset(self.parts[1::2])
+
+    def __repr__(self):
+        return f"<FactoidTemplate raw={self.raw!r}>"
+
+    def render(self, message, args: List[str]) -> str:
+        parts = self.parts
+        if len(parts) == 1:
+            text = parts[0]
+        else:
+            values = {name: placeholders[name](message, args) for name in self.slots}
+            # placeholders without a value are left as typed
+            text = "".join(
+                part if not index % 2 else (values[part] or f"<{part}>")
+                for index, part in enumerate(parts)
+            )
+        return f"*{text}*" if self.act else text
+
+
+class GuildFactoids:
+    """
+    One guild's factoids, plus their names kept in sorted order for
+    listings, prefix searches and suggestions, and a count of names per
+    display width so listings can pad them without measuring every name
+    """
+
+    __slots__ = ("facts", "words", "widths")
+
+    def __init__(self, facts: Dict[str, FactoidTemplate]):
+        self.facts = facts
+        self.words: List[str] = sorted(facts)
+        self.widths: Dict[int, int] = defaultdict(int)
+        for word in self.words:
+            self.widths[utils._string_width(word)] += 1
+
+    def __len__(self):
+        return len(self.facts)
+
+    def __contains__(self, word):
+        return word in self.facts
+
+    def __getitem__(self, word) -> FactoidTemplate:
+        return self.facts[word]
+
+    def __setitem__(self, word, template: FactoidTemplate):
+        if word not in self.facts:
+            insort(self.words, word)
+            self.widths[utils._string_width(word)] += 1
+        self.facts[word] = template
+
+    def get(self, word, default=None) -> Optional[FactoidTemplate]:
+        return self.facts.get(word, default)
+
+    def pop(self, word, default=None):
+        template = self.facts.pop(word, None)
+        if template is None:
+            return default
+        del self.words[bisect_left(self.words, word)]
+        width = utils._string_width(word)
+        self.widths[width] -= 1
+        if not self.widths[width]:
+            del self.widths[width]
+        return template
+
+    @property
+    def max_width(self) -> int:
+        """Display width of the widest name"""
+        return max(self.widths, default=0)
+
+    def items(self) -> Iterator[Tuple[str, FactoidTemplate]]:
+        """(word, template) pairs in word order, without building the list"""
+        facts = self.facts
+        for word in list(self.words):
+            template = facts.get(word)
+            if template is not None:
+                yield word, template
+
+    def with_prefix(self, prefix: str, limit: int = None) -> List[str]:
+        start = bisect_left(self.words, prefix)
+        matches = takewhile(lambda word: word.startswith(prefix), islice(self.words, start, None))
+        return list(islice(matches, limit))
+
+    def suggest(self, word: str, count=3) -> List[str]:
+        """
+        Close matches for ``word``, only looking at the few names that share
+        its first letters and have a similar length, so a miss stays cheap
+        """
+        if len(word) < SUGGEST_MIN_LENGTH:
+            return []
+        # a 0.8 ratio needs the shorter name to be at least 2/3 of the longer one
+        low, high = len(word) * 2 / 3, len(word) * 3 / 2
+        candidates = [
+            name for name in self.with_prefix(word[:SUGGEST_PREFIX_LENGTH], SUGGEST_CANDIDATES)
+            if low <= len(name) <= high
+        ]
+        return difflib.get_close_matches(word, candidates, n=count, cutoff=0.8)
+
+
+class FactoidCache:
+    """
+    Factoids per guild, loaded on first use and kept in a size-bounded LRU
+    """
+
+    def __init__(self, loader: Callable[[str], Awaitable[GuildFactoids]], max_guilds=500):
+        self.loader = loader
+        self.max_guilds = max_guilds
+        self.guilds: "OrderedDict[str, GuildFactoids]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        # guilds written to while being loaded, their loads may predate the write
+        self._stale: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.guilds)
+
+    def peek(self, guild_id: str) -> Optional[GuildFactoids]:
+        """The guild's factoids if they are loaded, without touching the database"""
+        facts = self.guilds.get(guild_id)
+        if facts is not None:
+            self.hits += 1
+            self.guilds.move_to_end(guild_id)
+        return facts
+
+    async def get(self, guild_id: str) -> GuildFactoids:
+        facts = self.peek(guild_id)
+        if facts is not None:
+            return facts
+
+        # concurrent misses for the same guild share one load
+        future = self._loading.get(guild_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = self._loading[guild_id] = asyncio.get_running_loop().create_future()
+        try:
+            facts = await self.loader(guild_id)
+        except Exception as e:
+            future.set_exception(e)
+            # retrieve it so a load nobody else waited on isn't reported as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._loading[guild_id]
+            stale = guild_id in self._stale
+            self._stale.discard(guild_id)
+
+        if not stale:
+            self.guilds[guild_id] = facts
+            while len(self.guilds) > self.max_guilds:
+                self.guilds.popitem(last=False)
+                self.evictions += 1
+        future.set_result(facts)
+        return facts
+
+    def written(self, guild_id: str) -> Optional[GuildFactoids]:
+        """
+        Called once a write to the guild's rows has finished. Returns the
+        cached factoids to update in place, or None if the guild isn't cached.
+        A load still in flight may have read the rows before the write, so
+        its result is handed to its callers but not cached.
+        """
+        if guild_id in self._loading:
+            self._stale.add(guild_id)
+        return self.guilds.get(guild_id)
+
+    def discard(self, guild_id: str):
+        """Drops a guild, it is read again on its next use"""
+        self.guilds.pop(guild_id, None)
+
+    def clear(self):
+        self.guilds.clear()
+
+
 class Factoids(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.log = logging.getLogger(__name__)
         self.db = database.Session
         self.table = FactoidsTable
         self.factoid_char = bot.config.bot_options.get('factoid_char', '?')
-        self.factoid_cache: Dict[str, Dict[str, str]] = defaultdict(default_dict.copy)
-        self.load_cache()
+        max_guilds = bot.config.bot_options.get('factoid_cache_guilds', 500)
+        self.factoid_cache = FactoidCache(self.load_guild, max_guilds=max_guilds)
         self.log.info("Factoids initialized")
 
     async def cog_command_error(self, ctx, error):
@@ -40,41 +271,38 @@ class Factoids(commands.Cog):
         if isinstance(error, commands.TooManyArguments):
             await ctx.send(f'You called the {ctx.command.name} command with too many arguments.')
 
-    def load_cache(self):
-        new_cache = self.factoid_cache.copy()
-        new_cache.clear()
-        for row in self.db.execute(select(self.table)).scalars().all():
-            # assign variables
-            chan = row.chan
-            word = row.word
-            data = row.data
-            new_cache[chan][word] = data
+    def _read_guild(self, session, chan):
+        query = select(self.table.word, self.table.data).where(self.table.chan == chan)
+        # every guild has the defaults, its own rows override them
+        facts = {word: FactoidTemplate(data) for word, data in default_dict.items()}
+        facts.update((row.word, FactoidTemplate(row.data)) for row in session.execute(query))
+        return GuildFactoids(facts)
 
-        self.factoid_cache.clear()
-        self.factoid_cache.update(new_cache)
+    async def load_guild(self, chan):
+        return await database.run(self._read_guild, chan)
 
-    def add_factoid(self, word, chan, data, nick):
+    async def add_factoid(self, word, chan, data, nick):
         """
         :type word: str
         :type chan: str
         :type data: str
         :type nick: str
         """
-        if word in self.factoid_cache[chan]:
-            # if we have a set value, update
-            self.db.execute(
-                update(self.table)
-                .where(self.table.chan == chan, self.table.word == word)
-                .values(data=data, nick=nick, chan=chan)
-            )
-            self.db.commit()
-        else:
-            # otherwise, insert
-            self.db.execute(insert(self.table).values(word=word, data=data, nick=nick, chan=chan))
-            self.db.commit()
-        self.load_cache()
-
-    def del_factoid(self, chan, word=None):
+        # the cache can't tell stored factoids from the defaults, so ask the table
+        updated = await database.execute(
+            update(self.table)
+            .where(self.table.chan == chan, self.table.word == word)
+            .values(data=data, nick=nick, chan=chan)
+        )
+        if not updated:
+            await database.execute(insert(self.table).values(word=word, data=data, nick=nick, chan=chan))
+
+        # looked up after the write, the guild may have been evicted or be loading meanwhile
+        facts = self.factoid_cache.written(chan)
+        if facts is not None:
+            facts[word] = FactoidTemplate(data)
+
+    async def del_factoid(self, chan, word=None):
         """
         :type chan: str
         :type word: str
@@ -84,9 +312,35 @@ class Factoids(commands.Cog):
         if word is not None:
             clause = and_(clause, self.table.word.in_(word))
 
-        self.db.execute(delete(self.table).where(clause))
-        self.db.commit()
-        self.load_cache()
+        await database.execute(delete(self.table).where(clause))
+        facts = self.factoid_cache.written(chan)
+        if word is None or facts is None:
+            # read again on next use
+            self.factoid_cache.discard(chan)
+        else:
+            for name in word:
+                facts.pop(name, None)
+                # a forgotten default comes back, as it does when the guild is read again
+                if name in default_dict:
+                    facts[name] = FactoidTemplate(default_dict[name])
+
+    @commands.command(aliases=["reloadfactoids"], hidden=True)
+    @commands.is_owner()
+    async def reloadfacts(self, ctx):
+        """- drops every cached guild so factoids are read again from the database"""
+        count = len(self.factoid_cache)
+        self.factoid_cache.clear()
+        await ctx.send(f"Dropped cached factoids for {count} guilds, they reload on next use.")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def factcache(self, ctx):
+        """- shows factoid cache statistics"""
+        cache = self.factoid_cache
+        await ctx.send(
+            f"Guilds cached: {len(cache)}/{cache.max_guilds}, "
+            f"hits: {cache.hits}, misses: {cache.misses}, evictions: {cache.evictions}"
+        )
 
     @commands.command(aliases=["r"])
     async def remember(self, ctx, word, *data):
@@ -94,6 +348,7 @@ class Factoids(commands.Cog):
         <word> [+]<data> - remembers <data> with <word> - add + to <data> to append.
         If the input starts with <act> the message will be sent as an action.
         If <user> in in the message it will be replaced by input arguments when command is called.
+        <arg2> is replaced by the second argument, <nick> by the caller and <channel> by the channel name.
         """
         try:
             word = word.lower()
@@ -102,7 +357,7 @@ class Factoids(commands.Cog):
             nick = str(getattr(ctx.author, 'name', None))
 
             try:
-                old_data = self.factoid_cache[guild_id][word]
+                old_data = (await self.factoid_cache.get(guild_id))[word].raw
             except LookupError:
                 old_data = None
 
@@ -126,21 +381,27 @@ class Factoids(commands.Cog):
                 if old_data:
                     await ctx.send(allowed_mentions=discord.AllowedMentions.none(), content=f"Previous data was **{old_data}**")
 
-            self.add_factoid(word, guild_id, data, nick)
+            await self.add_factoid(word, guild_id, data, nick)
         except Exception as e:
             await ctx.send("Error adding factoid!")
             self.log.error('Exception', exc_info=True)
         return
 
     def get_max_size(self, facts):
-        as_lengths = (utils._string_width(self.factoid_char + fact[0]) for fact in sorted(facts.items()))
-        return max(as_lengths, default=0)
+        if not facts:
+            return 0
+        return utils._string_width(self.factoid_char) + facts.max_width
 
     def shorten_text(self, text, width):
         if len(text) > width:
             return text[:width - 3].rstrip() + '...'
         return text
 
+    def format_fact(self, word, template, max_size, width):
+        name = self.factoid_char + word
+        max_width = max_size - (utils._string_width(name) - len(name))
+        return self.shorten_text(f'{name:<{max_width}} {template.raw}', width)
+
     async def paste_facts(
         self,
         ctx,
@@ -156,39 +417,36 @@ class Factoids(commands.Cog):
             return
 
         max_size = max_size or self.get_max_size(facts)
-        get_width = utils._string_width
-
-        entries = []
-        for fact in sorted(facts.items()):
-            name = self.factoid_char + fact[0]
-            max_width = max_size - (get_width(name) - len(name))
-            entry = f'{name:<{max_width}} {fact[1]}'
-            entries.append(self.shorten_text(entry, width))
 
         if dm:
             dm_channel = await ctx.author.create_dm()
         else:
             dm_channel = None
 
+        # only the page being shown is formatted, the rest is never built
         if text:
-            input_text = '\n'.join(entries)
-            pages = RoboPages(TextPageSource(input_text, heading=heading))
-            try:
-                await pages.start(ctx, channel=dm_channel)
-            except menus.MenuError as e:
-                await ctx.send(str(e))
+            lines = (self.format_fact(word, template, max_size, width) for word, template in facts.items())
+            pages = RoboPages(IterTextPageSource(lines, heading=heading))
         else:
-            pages = SimplePages(entries=entries, per_page=25)
-            try:
-                await pages.start(ctx, channel=dm_channel)
-            except menus.MenuError as e:
-                await ctx.send(str(e))
+            def fetch(offset, limit):
+                return facts.words[offset:offset + limit]
+
+            def formatter(words):
+                return [self.format_fact(word, facts[word], max_size, width) for word in words if word in facts]
+
+            pages = LazySimplePages(fetch, len(facts), per_page=25, formatter=formatter)
+
+        try:
+            await pages.start(ctx, channel=dm_channel)
+        except menus.MenuError as e:
+            await ctx.send(str(e))
 
     async def remove_fact(self, ctx, guild_id, names):
-        found = {}
+        found = GuildFactoids({})
         missing = []
+        facts = await self.factoid_cache.get(guild_id)
         for name in names:
-            data = self.factoid_cache[guild_id].get(name.lower())
+            data = facts.get(name.lower())
             if data:
                 found[name] = data
             else:
@@ -203,7 +461,7 @@ class Factoids(commands.Cog):
 
         if found:
             await self.paste_facts(ctx, found, heading="Removed facts:", text=True, dm=False)
-            self.del_factoid(guild_id, list(found.keys()))
+            await self.del_factoid(guild_id, list(found.words))
 
     @commands.command(aliases=["f"])
     async def forget(self, ctx, *, word) :
@@ -215,8 +473,8 @@ class Factoids(commands.Cog):
     @checks.is_mod()
     async def forget_all(self, ctx):
         guild_id = str(getattr(ctx.guild, 'id', None))
-        await self.paste_facts(ctx, self.factoid_cache[guild_id], width=500, heading="Removed facts:", text=True)
-        self.del_factoid(guild_id)
+        await self.paste_facts(ctx, await self.factoid_cache.get(guild_id), width=500, heading="Removed facts:", text=True)
+        await self.del_factoid(guild_id)
         return await ctx.send("Facts cleared.")
 
     @commands.command()
@@ -225,7 +483,7 @@ class Factoids(commands.Cog):
         guild_id = str(getattr(ctx.guild, 'id', None))
         text = text.strip().lower()
         query = select(self.table).where(self.table.chan == guild_id, self.table.word == text)
-        res = self.db.execute(query).scalars().all()
+        res = await database.scalars(query)
 
         if res:
             for row in res:
@@ -236,37 +494,63 @@ class Factoids(commands.Cog):
     @commands.Cog.listener('on_message')
     async def factoid(self, message):
         """<word> - shows what data is associated with <word>"""
-        if message.author.bot:
+        # runs for every message, so reject non-factoids before touching anything else
+        content = message.content
+        if not content.startswith(self.factoid_char) or message.author.bot:
             return
 
+        word, _, rest = content[len(self.factoid_char):].lstrip().partition(" ")
+        if not word:
+            return
+
+        start = perf_counter()
+        try:
+            await self.serve_factoid(message, word.lower(), rest)
+        finally:
+            _listener_latency.observe(perf_counter() - start)
+
+    async def serve_factoid(self, message, word, rest):
         guild_id = str(getattr(message.guild, 'id', None))
-        content = str(getattr(message, 'content'))
-        if len(content) > 0:
-            if content[0] == self.factoid_char:
-                content = content[1:]
-                arg1 = ""
-                if len(content.split()) >= 2:
-                    arg1 = content.split()[1]
-                # split up the input
-                split = content.strip().split(" ")
-                factoid_text = split[0].lower()
-
-                if factoid_text in self.factoid_cache[guild_id]:
-                    result = self.factoid_cache[guild_id][factoid_text]
-
-                    # factoid post-processors
-                    if arg1:
-                        result = result.replace("<user>", arg1)
-                    if result.startswith("<act>"):
-                        result = result[5:].strip()
-                        return await message.channel.send(allowed_mentions=discord.AllowedMentions.none(), content=f"*{result}*")
-                    else:
-                        return await message.channel.send(allowed_mentions=discord.AllowedMentions.none(), content=result)
-            else:
-                return
-        else: 
+        facts = self.factoid_cache.peek(guild_id)
+        if facts is None:
+            facts = await self.factoid_cache.get(guild_id)
+
+        if word.endswith("*"):
+            FACTOIDS.labels('prefix').inc()
+            return await self.list_prefix(message, facts, word[:-1])
+
+        result = facts.facts.get(word)
+        if result is None:
+            FACTOIDS.labels('miss').inc()
+            suggestions = facts.suggest(word)
+            if suggestions:
+                names = get_text_list([f"`{self.factoid_char}{name}`" for name in suggestions])
+                await message.channel.send(
+                    allowed_mentions=discord.AllowedMentions.none(), content=f"Unknown factoid, did you mean {names}?"
+                )
             return
 
+        FACTOIDS.labels('hit').inc()
+        # only split out the arguments when the factoid has placeholders
+        args = rest.split(None, 2) if result.slots else ()
+        return await message.channel.send(
+            allowed_mentions=discord.AllowedMentions.none(), content=result.render(message, args)
+        )
+
+    async def list_prefix(self, message, facts: GuildFactoids, prefix, limit=25):
+        """Handles ?prefix* by listing the factoids starting with prefix"""
+        if not prefix:
+            return
+
+        words = facts.with_prefix(prefix, limit=limit + 1)
+        if not words:
+            content = f"No factoids start with `{prefix}`."
+        else:
+            more = " and more" if len(words) > limit else ""
+            listing = ", ".join(self.factoid_char + word for word in words[:limit])
+            content = f"Factoids starting with `{prefix}`: {listing}{more}"
+        await message.channel.send(allowed_mentions=discord.AllowedMentions.none(), content=content)
+
     @commands.command(aliases=['listfactoids'])
     async def listfacts(self, ctx):
         """- lists all available factoids"""
@@ -274,8 +558,8 @@ class Factoids(commands.Cog):
         guild_id = str(getattr(ctx.guild, 'id', None))
         reply_text: List[str] = []
         reply_text_length = 0
-        for word in sorted(self.factoid_cache[guild_id].keys()):
-            reply_text.append(word)
+        # already in order, so this is a copy rather than a sort
+        reply_text.extend((await self.factoid_cache.get(guild_id)).words)
 
         pages = SimplePages(entries=reply_text, per_page=25)
         try:
@@ -287,7 +571,7 @@ class Factoids(commands.Cog):
     @commands.command(aliases=['listdetailedfacts'])
     async def listdetailedfactoids(self, ctx):
         guild_id = str(getattr(ctx.guild, 'id', None))
-        return await self.paste_facts(ctx, self.factoid_cache[guild_id])
+        return await self.paste_facts(ctx, await self.factoid_cache.get(guild_id))
 
 def setup(bot):
     bot.add_cog(Factoids(bot))
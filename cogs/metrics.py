@@ -0,0 +1,75 @@
+from aiohttp import web
+from discord.ext import commands
+import logging
+import psutil
+
+from util import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Metrics(commands.Cog):
+    """Serves the process metrics over HTTP for Prometheus to scrape."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.process = psutil.Process()
+        options = bot.config.get('metrics_options') or {}
+        self.host = options.get('host', '127.0.0.1')
+        self.port = options.get('port', 9100)
+        self.runner = None
+        self.register_gauges()
+        self.bot.loop.create_task(self.start_server())
+
+    def cog_unload(self):
+        if self.runner is not None:
+            self.bot.loop.create_task(self.runner.cleanup())
+
+    def _cog_size(self, cog_name, size):
+        # raises while the cog isn't loaded, which leaves the gauge out of the scrape
+        def get():
+            return size(self.bot.get_cog(cog_name))
+        return get
+
+    def register_gauges(self):
+        """Gauges that are read when scraped rather than kept up to date."""
+        bot = self.bot
+        metrics.PROCESS_MEMORY.labels('rss').set_function(lambda: self.process.memory_info().rss)
+        metrics.GUILDS.set_function(lambda: len(bot.guilds))
+        metrics.GATEWAY_LATENCY.set_function(lambda: bot.latency)
+
+        queues = metrics.QUEUE_DEPTH
+        queues.labels('commands').set_function(self._cog_size('Stats', lambda cog: len(cog._data_batch)))
+        queues.labels('webhook').set_function(self._cog_size('Stats', lambda cog: len(cog.sink)))
+        queues.labels('duck_scores').set_function(self._cog_size('Duckhunt', lambda cog: len(cog.score_buffer)))
+
+        caches = metrics.CACHE_SIZE
+        caches.labels('factoid_guilds').set_function(self._cog_size('Factoids', lambda cog: len(cog.factoid_cache)))
+        caches.labels('cooldowns').set_function(lambda: len(bot.spam_control._cache))
+        caches.labels('spam_counts').set_function(lambda: len(bot._auto_spam_count))
+        caches.labels('duck_cooldowns').set_function(self._cog_size('Duckhunt', lambda cog: len(cog.scripters)))
+
+    async def start_server(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError:
+            log.error('Could not serve metrics on %s:%s', self.host, self.port, exc_info=True)
+            await runner.cleanup()
+            return
+
+        self.runner = runner
+        log.info('Serving metrics on http://%s:%s/metrics', self.host, self.port)
+
+    async def handle_metrics(self, request):
+        return web.Response(
+            body=metrics.REGISTRY.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        )
+
+
+def setup(bot):
+    bot.add_cog(Metrics(bot))
@@ -2,7 +2,7 @@ import random
 import re
 import time
 
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy import Table, Column, String, PrimaryKeyConstraint
 from sqlalchemy.types import REAL
 from sqlalchemy.exc import IntegrityError 
@@ -10,6 +10,8 @@ import logging
 import discord
 from discord.ext import commands
 
+from util import database
+
 class Quotes(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
@@ -18,7 +20,7 @@ class Quotes(commands.Cog):
 
         self.table = Table(
             'quote',
-            bot.db_metadata,
+            database.metadata,
             Column('chan', String(25)),
             Column('nick', String(25)),
             Column('add_nick', String(25)),
@@ -27,7 +29,7 @@ class Quotes(commands.Cog):
             Column('deleted', String(5), default=0),
             PrimaryKeyConstraint('chan', 'nick', 'time')
         )
-        self.db = bot.db_session
+        self.db = database.Session
         self.log.info("Quotes initialized")
 
     async def cog_command_error(self, ctx, error):
@@ -40,11 +42,11 @@ class Quotes(commands.Cog):
             if ctx.message.reference and author_name == None and num == None:
                 try:
                     quoted_msg = await ctx.fetch_message(ctx.message.reference.message_id)
-                    return await ctx.send(self.add_quote(ctx.guild.id, quoted_msg.author.name, ctx.author.name, quoted_msg.content))
+                    return await ctx.send(await self.add_quote(ctx.guild.id, quoted_msg.author.name, ctx.author.name, quoted_msg.content))
                 except:
                     return self.log.error('failed to fetch reply source', exc_info=1)
             else:
-                return self.get_quote_by_author(ctx.guild.id, author_name, num)
+                return await ctx.send(await self.get_quote_by_author(ctx.guild.id, author_name, num))
         except: 
             return self.log.error('failed to generate quote', exc_info=1)
             
@@ -56,7 +58,7 @@ class Quotes(commands.Cog):
                                                 nick, msg)
 
 
-    def add_quote(self, chan, target, sender, message):
+    async def add_quote(self, chan, target, sender, message):
         """Adds a quote to a nick, returns message string"""
         try:
             query = self.table.insert().values(
@@ -66,8 +68,7 @@ class Quotes(commands.Cog):
                 msg=message,
                 time=time.time()
             )
-            self.db.execute(query)
-            self.db.commit()
+            await database.execute(query)
         except IntegrityError:
             return "Message already stored, doing nothing."
         return "Quote added."
@@ -84,6 +85,7 @@ class Quotes(commands.Cog):
         # self.db.commit()
 
 
+    @staticmethod
     def get_quote_num(num, count, name):
         """Returns the quote number to fetch from the DB"""
         if num:  # Make sure num is a number if it isn't false
@@ -101,36 +103,31 @@ class Quotes(commands.Cog):
         return num
 
 
-    def get_quote_by_author(self, guild_id, author_name, num=False):
+    async def get_quote_by_author(self, guild_id, author_name, num=False):
         """Returns a formatted quote from a nick, random or selected by number"""
-
+        author_name = author_name.lower()
         self.log.info("quote guild_id: {} quote author: {}".format(guild_id, author_name))
-        try: 
-            count_query = select([self.table]) \
-                .where(self.table.c.deleted != 1) \
-                .where(self.table.c.chan == guild_id) \
-                .where(self.table.c.nick == author_name) \
-                .count()
-            count = db.execute(count_query).fetchall()[0][0]
-            self.log.info("quote count: {} quote guild_id: {} quote author: {}".format(count, guild_id, author_name))
-        except AttributeError:
-            self.log.info("no quotes", exc_info=1) 
-            return
+        clause = (
+            (self.table.c.deleted != 1)
+            & (self.table.c.chan == guild_id)
+            & (self.table.c.nick == author_name)
+        )
+        count_query = select(func.count()).select_from(self.table).where(clause)
+        count = (await database.scalars(count_query))[0]
+        self.log.info("quote count: {} quote guild_id: {} quote author: {}".format(count, guild_id, author_name))
         try:
-            num = get_quote_num(num, count, author_name)
+            num = self.get_quote_num(num, count, author_name)
         except Exception as error_message:
-            return error_message
+            return str(error_message)
 
-        query = select([self.table.c.time, self.table.c.nick, self.table.c.msg]) \
-            .where(self.table.c.deleted != 1) \
-            .where(self.table.c.chan == guild_id) \
-            .where(self.table.c.nick == author_name) \
-            .order_by(self.table.c.time)\
+        query = select(self.table.c.nick, self.table.c.msg) \
+            .where(clause) \
+            .order_by(self.table.c.time) \
             .limit(1) \
-            .offset((num - 1))
-        data = self.db.execute(query).fetchall()[0]
-        return format_quote(data, num, count)
-        
+            .offset(num - 1)
+        nick, msg = (await database.fetchall(query))[0]
+        return self.format_quote(nick, msg, num, count)
+
 
 def setup(bot):
     bot.add_cog(Quotes(bot))
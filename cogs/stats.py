@@ -1,7 +1,12 @@
 from discord.ext import commands, tasks, menus
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
+from time import perf_counter
 
 from .utils import time
+from .utils.webhook import WebhookSink
+from util import database, metrics
+
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Integer, String, desc, func, insert, select
 
 import pkg_resources
 import logging
@@ -32,6 +37,18 @@ class GatewayHandler(logging.Handler):
         self.cog.add_record(record)
 
 
+class CommandsTable(database.base):
+    __tablename__ = 'commands'
+    id = Column(Integer(), primary_key=True)
+    guild_id = Column(BigInteger(), index=True)
+    channel_id = Column(BigInteger())
+    author_id = Column(BigInteger(), index=True)
+    used = Column(DateTime(), index=True)
+    prefix = Column(String())
+    command = Column(String(), index=True)
+    failed = Column(Boolean())
+
+
 def hex_value(arg):
     return int(arg, base=16)
 
@@ -49,16 +66,60 @@ class Stats(commands.Cog):
         self.process = psutil.Process()
         self._batch_lock = asyncio.Lock()
         self._data_batch = []
-        self._gateway_queue = asyncio.Queue()
-        self.gateway_worker.start()
+        options = bot.config.get('stats_options') or {}
+
+        # gateway notices and error embeds, batched and rate limited
+        self.sink = WebhookSink(
+            self.webhook,
+            interval=options.get('webhook_interval', 2.0),
+            max_queue=options.get('webhook_max_queue', 500),
+            loop=bot.loop,
+        )
+        self.sink.start()
+
+        self.batch_size = options.get('command_batch_size', 100)
+        # rows kept while the database is unreachable, the oldest are dropped first
+        self.max_pending = options.get('command_max_pending', 10000)
+        self.bulk_insert_loop.change_interval(seconds=options.get('command_flush_interval', 10))
+        self.bulk_insert_loop.start()
+
+        # the latest invocations that took longer than bot.slow_command_threshold
+        self.slow_commands = deque(maxlen=options.get('slow_command_log_size', 25))
 
     def cog_unload(self):
-        self.gateway_worker.cancel()
+        self.sink.stop()
+        self.bulk_insert_loop.cancel()
+        self.bot.loop.create_task(self.bulk_insert())
 
-    @tasks.loop(seconds=0.0)
-    async def gateway_worker(self):
-        record = await self._gateway_queue.get()
-        await self.notify_gateway_status(record)
+    async def flush(self):
+        """Called by the bot on shutdown to write out the waiting commands and notices"""
+        await self.bulk_insert()
+        await self.sink.flush()
+
+    def _insert_commands(self, session, batch):
+        session.execute(insert(CommandsTable), batch)
+        session.commit()
+
+    async def bulk_insert(self):
+        async with self._batch_lock:
+            batch, self._data_batch = self._data_batch, []
+
+        if not batch:
+            return
+
+        try:
+            await database.run(self._insert_commands, batch)
+        except Exception:
+            log.error('Failed to insert %d commands', len(batch), exc_info=True)
+            async with self._batch_lock:
+                self._data_batch[:0] = batch
+                del self._data_batch[:-self.max_pending]
+        else:
+            log.info('Inserted %d commands', len(batch))
+
+    @tasks.loop(seconds=10.0)
+    async def bulk_insert_loop(self):
+        await self.bulk_insert()
 
     async def register_command(self, ctx):
         if ctx.command is None:
@@ -66,34 +127,70 @@ class Stats(commands.Cog):
 
         command = ctx.command.qualified_name
         self.bot.command_stats[command] += 1
+        metrics.COMMANDS.labels(command, 'true' if ctx.command_failed else 'false').inc()
         message = ctx.message
-        destination = None
         if ctx.guild is None:
-            destination = 'Private Message'
             guild_id = None
+            log.info('%s: %s in Private Message: %s', message.created_at, message.author, message.content)
         else:
-            destination = f'#{message.channel} ({message.guild})'
             guild_id = ctx.guild.id
-
-        log.info(f'{message.created_at}: {message.author} in {destination}: {message.content}')
+            log.info('%s: %s in #%s (%s): %s', message.created_at, message.author,
+                     message.channel, message.guild, message.content)
         async with self._batch_lock:
             self._data_batch.append({
-                'guild': guild_id,
-                'channel': ctx.channel.id,
-                'author': ctx.author.id,
-                'used': message.created_at.isoformat(),
+                'guild_id': guild_id,
+                'channel_id': ctx.channel.id,
+                'author_id': ctx.author.id,
+                'used': message.created_at,
                 'prefix': ctx.prefix,
                 'command': command,
                 'failed': ctx.command_failed,
             })
+            waiting = len(self._data_batch)
+
+        if waiting >= self.batch_size:
+            await self.bulk_insert()
 
     @commands.Cog.listener()
     async def on_command_completion(self, ctx):
         await self.register_command(ctx)
 
+    @commands.Cog.listener()
+    async def on_command_timed(self, ctx, elapsed):
+        name = ctx.command.qualified_name
+        timings = getattr(ctx, 'timings', None)
+        if timings is None:
+            # invoked with a plain commands.Context, so only the total is known
+            metrics.COMMAND_PHASE_LATENCY.labels(name, 'total').observe(elapsed)
+            return
+
+        callback = max(elapsed - sum(timings.values()), 0.0)
+        for phase, seconds in (*timings.items(), ('callback', callback), ('total', elapsed)):
+            metrics.COMMAND_PHASE_LATENCY.labels(name, phase).observe(seconds)
+
+        if elapsed < self.bot.slow_command_threshold:
+            return
+
+        # ctx.args starts with the cog, if there is one, and the context
+        args = [repr(arg) for arg in ctx.args[2 if ctx.command.cog is not None else 1:]]
+        args.extend(f'{key}={value!r}' for key, value in ctx.kwargs.items())
+        phases = ', '.join(f'{phase} {seconds * 1000:.0f}ms' for phase, seconds in (*timings.items(), ('callback', callback)))
+        log.warning('Slow command %s took %.2fs (%s) by %s: %s\n%s', name, elapsed, phases,
+                    ctx.author.id, ctx.message.content, ctx.slow_stack or '')
+        self.slow_commands.append({
+            'when': ctx.message.created_at,
+            'command': name,
+            'elapsed': elapsed,
+            'phases': phases,
+            'args': ', '.join(args),
+            'content': ctx.message.content,
+            'stack': ctx.slow_stack,
+        })
+
     @commands.Cog.listener()
     async def on_socket_response(self, msg):
         self.bot.socket_stats[msg.get('t')] += 1
+        metrics.SOCKET_EVENTS.labels(msg.get('t') or 'NONE').inc()
 
     @discord.utils.cached_property
     def webhook(self):
@@ -118,15 +215,16 @@ class Stats(commands.Cog):
             e.add_field(name='Channel', value=channel)
             e.add_field(name='Guild', value=guild)
 
-        await self.webhook.send(embed=e)
+        self.sink.send_embed(e)
 
-    @commands.command(hidden=True)
+    @commands.group(hidden=True, invoke_without_command=True)
     @commands.is_owner()
     async def commandstats(self, ctx, limit=20):
         """Shows command stats.
 
         Use a negative number for bottom instead of top.
-        This is only for the current session.
+        This is only for the current session, see the subcommands for
+        the stats kept in the database.
         """
         counter = self.bot.command_stats
         width = len(max(counter, key=len))
@@ -141,6 +239,177 @@ class Stats(commands.Cog):
 
         await ctx.send(f'```\n{output}\n```')
 
+    def _top(self, session, column, *where, limit=5):
+        uses = func.count().label('uses')
+        query = select(column, uses).where(*where).group_by(column).order_by(desc(uses)).limit(limit)
+        return session.execute(query).all()
+
+    def _summary(self, session, *where):
+        query = select(func.count(), func.min(CommandsTable.used)).select_from(CommandsTable).where(*where)
+        return session.execute(query).one()
+
+    def _global_stats(self, session):
+        return (
+            self._summary(session),
+            self._top(session, CommandsTable.command),
+            self._top(session, CommandsTable.guild_id, CommandsTable.guild_id.isnot(None)),
+            self._top(session, CommandsTable.author_id),
+        )
+
+    def _guild_stats(self, session, guild_id):
+        where = CommandsTable.guild_id == guild_id
+        return (
+            self._summary(session, where),
+            self._top(session, CommandsTable.command, where),
+            self._top(session, CommandsTable.channel_id, where),
+            self._top(session, CommandsTable.author_id, where),
+        )
+
+    def _command_stats(self, session, name):
+        where = CommandsTable.command == name
+        failed = session.execute(
+            select(func.count()).select_from(CommandsTable).where(where, CommandsTable.failed.is_(True))
+        ).scalar()
+        return (
+            self._summary(session, where),
+            failed,
+            self._top(session, CommandsTable.guild_id, where, CommandsTable.guild_id.isnot(None)),
+            self._top(session, CommandsTable.author_id, where),
+        )
+
+    def _format_top(self, rows, fmt):
+        if not rows:
+            return 'No uses.'
+        return '\n'.join(f'{fmt(key)}: {uses} uses' for key, uses in rows)
+
+    def _stats_embed(self, title, summary):
+        total, first_used = summary
+        embed = discord.Embed(title=title, colour=discord.Colour.blurple())
+        embed.description = f'{total} commands used.'
+        if first_used is not None:
+            embed.timestamp = first_used
+            embed.set_footer(text='Tracking command usage since')
+        return embed
+
+    def _format_guild(self, guild_id):
+        guild = self.bot.get_guild(guild_id)
+        return f'{guild} ({guild_id})' if guild else f'<Unknown {guild_id}>'
+
+    def _format_user(self, user_id):
+        return f'<@!{user_id}>'
+
+    @commandstats.command(name='global')
+    @commands.is_owner()
+    async def commandstats_global(self, ctx):
+        """All-time command stats across every guild."""
+        await self.bulk_insert()
+        summary, top_commands, top_guilds, top_users = await database.run(self._global_stats)
+
+        embed = self._stats_embed('Command Stats', summary)
+        embed.add_field(name='Top Commands', value=self._format_top(top_commands, str), inline=False)
+        embed.add_field(name='Top Guilds', value=self._format_top(top_guilds, self._format_guild), inline=False)
+        embed.add_field(name='Top Users', value=self._format_top(top_users, self._format_user), inline=False)
+        await ctx.send(embed=embed)
+
+    @commandstats.command(name='guild')
+    @commands.is_owner()
+    async def commandstats_guild(self, ctx, guild_id: int = None):
+        """All-time command stats for this or another guild."""
+        if guild_id is None:
+            if ctx.guild is None:
+                return await ctx.send('Give a guild ID to use this in private messages.')
+            guild_id = ctx.guild.id
+
+        await self.bulk_insert()
+        summary, top_commands, top_channels, top_users = await database.run(self._guild_stats, guild_id)
+
+        embed = self._stats_embed(f'Command Stats for {self._format_guild(guild_id)}', summary)
+        embed.add_field(name='Top Commands', value=self._format_top(top_commands, str), inline=False)
+        embed.add_field(name='Top Channels', value=self._format_top(top_channels, lambda c: f'<#{c}>'), inline=False)
+        embed.add_field(name='Top Users', value=self._format_top(top_users, self._format_user), inline=False)
+        await ctx.send(embed=embed)
+
+    @commandstats.command(name='command')
+    @commands.is_owner()
+    async def commandstats_command(self, ctx, *, name):
+        """All-time stats for a single command."""
+        command = self.bot.get_command(name)
+        if command is not None:
+            name = command.qualified_name
+
+        await self.bulk_insert()
+        summary, failed, top_guilds, top_users = await database.run(self._command_stats, name)
+
+        embed = self._stats_embed(f'Command Stats for {name}', summary)
+        embed.description = f'{summary[0]} uses, {failed} failed.'
+        embed.add_field(name='Top Guilds', value=self._format_top(top_guilds, self._format_guild), inline=False)
+        embed.add_field(name='Top Users', value=self._format_top(top_users, self._format_user), inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def commandtimings(self, ctx, *, name=None):
+        """Shows how long commands take this session.
+
+        Without a command name this lists the slowest commands by mean time,
+        with one it splits that command's time into phases. p50/p95 are the
+        upper bounds of the histogram buckets they fall in.
+        """
+        children = metrics.COMMAND_PHASE_LATENCY._children
+        if name is None:
+            rows = [
+                (command, hist) for (command, phase), hist in children.items()
+                if phase == 'total' and hist.count
+            ]
+            rows.sort(key=lambda row: row[1].sum / row[1].count, reverse=True)
+            if not rows:
+                return await ctx.send('No commands timed yet.')
+            header = 'command'
+        else:
+            command = self.bot.get_command(name)
+            name = command.qualified_name if command is not None else name
+            order = ('check', 'conversion', 'callback', 'send', 'total')
+            rows = [
+                (phase, children[(name, phase)]) for phase in order
+                if (name, phase) in children and children[(name, phase)].count
+            ]
+            if not rows:
+                return await ctx.send(f'{name} has not been timed yet.')
+            header = 'phase'
+
+        def ms(seconds):
+            return 'inf' if seconds == float('inf') else f'{seconds * 1000:.1f}'
+
+        paginator = commands.Paginator()
+        paginator.add_line(f'{header:<24} {"count":>7} {"mean ms":>9} {"p50 ms":>8} {"p95 ms":>8}')
+        for key, hist in rows[:25]:
+            mean = hist.sum / hist.count
+            paginator.add_line(
+                f'{key[:24]:<24} {hist.count:>7} {ms(mean):>9} {ms(hist.quantile(0.5)):>8} {ms(hist.quantile(0.95)):>8}'
+            )
+
+        for page in paginator.pages:
+            await ctx.send(page)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def slowcommands(self, ctx, count=5):
+        """Shows the latest commands that passed the slow command threshold."""
+        if not self.slow_commands:
+            return await ctx.send(f'No commands took longer than {self.bot.slow_command_threshold}s.')
+
+        paginator = commands.Paginator(prefix='```py')
+        for entry in list(self.slow_commands)[-count:]:
+            paginator.add_line(f"# {entry['when']:%Y-%m-%d %H:%M:%S} {entry['command']} took {entry['elapsed']:.2f}s")
+            paginator.add_line(f"# {entry['phases']}")
+            paginator.add_line(f"# args: {textwrap.shorten(entry['args'] or '-', width=500)}")
+            for line in (entry['stack'] or '# finished before its stack was captured').splitlines():
+                paginator.add_line(line[:1900])
+            paginator.add_line()
+
+        for page in paginator.pages:
+            await ctx.send(page)
+
     @commands.command(hidden=True)
     async def socketstats(self, ctx):
         delta = datetime.datetime.utcnow() - self.bot.uptime
@@ -224,6 +493,11 @@ class Stats(commands.Cog):
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
+        # unknown commands aren't usage, anything else that errored is recorded
+        # with failed set, dispatch_error marks the context before we get here
+        if isinstance(error, commands.CommandNotFound):
+            return
+
         await self.register_command(ctx)
         if not isinstance(error, (commands.CommandInvokeError, commands.ConversionError)):
             return
@@ -246,14 +520,15 @@ class Stats(commands.Cog):
         exc = ''.join(traceback.format_exception(type(error), error, error.__traceback__, chain=False))
         e.description = f'```py\n{exc}\n```'
         e.timestamp = datetime.datetime.utcnow()
-        await self.webhook.send(embed=e)
+        self.sink.send_embed(e)
 
     def add_record(self, record):
         # if self.bot.config.debug:
         #     return
-        self._gateway_queue.put_nowait(record)
+        # the gateway's keep-alive thread logs too
+        self.bot.loop.call_soon_threadsafe(self.notify_gateway_status, record)
 
-    async def notify_gateway_status(self, record):
+    def notify_gateway_status(self, record):
         attributes = {
             'INFO': '\N{INFORMATION SOURCE}',
             'WARNING': '\N{WARNING SIGN}'
@@ -261,8 +536,8 @@ class Stats(commands.Cog):
 
         emoji = attributes.get(record.levelname, '\N{CROSS MARK}')
         dt = datetime.datetime.utcfromtimestamp(record.created)
-        msg = textwrap.shorten(f'{emoji} `[{dt:%Y-%m-%d %H:%M:%S}] {record.message}`', width=1990)
-        await self.webhook.send(msg, username='Gateway', avatar_url='https://i.imgur.com/4PnCKB3.png')
+        msg = textwrap.shorten(f'{emoji} `[{dt:%Y-%m-%d %H:%M:%S}] {record.getMessage()}`', width=1990)
+        self.sink.send_line(msg, username='Gateway', avatar_url='https://i.imgur.com/4PnCKB3.png')
 
     @commands.command(hidden=True)
     @commands.is_owner()
@@ -289,6 +564,15 @@ class Stats(commands.Cog):
 
         description.append(f'Current Spammers: {", ".join(being_spammed) if being_spammed else "None"}')
 
+        duckhunt = self.bot.get_cog('Duckhunt')
+        expiring = [
+            f'Cooldowns: {len(spam_control._cache)}',
+            f'Spam Counts: {len(self.bot._auto_spam_count)}',
+        ]
+        if duckhunt is not None:
+            expiring.append(f'Duck Cooldowns: {len(duckhunt.scripters)}')
+        embed.add_field(name='Expiring State', value='\n'.join(expiring))
+
         if being_spammed:
             embed.colour = WARNING
             total_warnings += 1
@@ -322,6 +606,15 @@ class Stats(commands.Cog):
         is_locked = self._batch_lock.locked()
         description.append(f'Commands Waiting: {command_waiters}, Batch Locked: {is_locked}')
 
+        sink = self.sink
+        description.append(f'Webhook Queue: {len(sink)}/{sink.max_queue}, Dropped: {sink.dropped_total}, Sent: {sink.sent}')
+        if len(sink) >= sink.max_queue // 2:
+            total_warnings += 1
+            embed.colour = WARNING
+
+        prefix_filter = self.bot.prefix_filter_stats
+        description.append(f'Messages Without Prefix: {prefix_filter["skipped"]}, Parsed: {prefix_filter["passed"]}')
+
         memory_usage = self.process.memory_full_info().uss / 1024**2
         cpu_usage = self.process.cpu_percent() / psutil.cpu_count()
         embed.add_field(name='Process', value=f'{memory_usage:.2f} MiB\n{cpu_usage:.2f}% CPU', inline=False)
@@ -365,6 +658,28 @@ class Stats(commands.Cog):
             await ctx.send(page)
 
 old_on_error = commands.Bot.on_error
+old_can_run = commands.Command.can_run
+old_parse_arguments = commands.Command._parse_arguments
+
+def _add_timing(command, ctx, phase, start):
+    timings = getattr(ctx, 'timings', None)
+    # the help command runs can_run on other commands, those aren't its check phase
+    if timings is not None and ctx.command is command:
+        timings[phase] += perf_counter() - start
+
+async def can_run(self, ctx):
+    start = perf_counter()
+    try:
+        return await old_can_run(self, ctx)
+    finally:
+        _add_timing(self, ctx, 'check', start)
+
+async def _parse_arguments(self, ctx):
+    start = perf_counter()
+    try:
+        return await old_parse_arguments(self, ctx)
+    finally:
+        _add_timing(self, ctx, 'conversion', start)
 
 async def on_error(self, event, *args, **kwargs):
     e = discord.Embed(title='Event Error', colour=0xa32952)
@@ -377,11 +692,9 @@ async def on_error(self, event, *args, **kwargs):
         args_str.append(f'[{index}]: {arg!r}')
     args_str.append('```')
     e.add_field(name='Args', value='\n'.join(args_str), inline=False)
-    hook = self.get_cog('Stats').webhook
-    try:
-        await hook.send(embed=e)
-    except:
-        pass
+    stats = self.get_cog('Stats')
+    if stats is not None:
+        stats.sink.send_embed(e)
 
 def setup(bot):
     if not hasattr(bot, 'command_stats'):
@@ -395,8 +708,12 @@ def setup(bot):
     bot._stats_cog_gateway_handler = handler = GatewayHandler(cog)
     logging.getLogger().addHandler(handler)
     commands.Bot.on_error = on_error
+    commands.Command.can_run = can_run
+    commands.Command._parse_arguments = _parse_arguments
 
 def teardown(bot):
     commands.Bot.on_error = old_on_error
+    commands.Command.can_run = old_can_run
+    commands.Command._parse_arguments = old_parse_arguments
     logging.getLogger().removeHandler(bot._stats_cog_gateway_handler)
     del bot._stats_cog_gateway_handler
@@ -0,0 +1,124 @@
+from heapq import heappop, heappush
+from math import ceil
+import time
+
+from discord.ext import commands
+
+_MISSING = object()
+
+
+class ExpiringMap:
+    """A dict whose entries drop out once they expire.
+
+    Entries expire ``ttl`` seconds after they were set unless given their own
+    ``expires`` time. Expiry times are grouped into ``resolution`` second
+    buckets, so purging only looks at the buckets that have run out instead
+    of scanning every key. Expired entries are never returned, even before
+    they have been purged.
+    """
+
+    def __init__(self, ttl, *, resolution=1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.resolution = resolution
+        self.clock = clock
+        # key: (expires, value)
+        self._data = {}
+        # bucket number: keys that expire in it, plus a heap of the bucket numbers
+        self._buckets = {}
+        self._bucket_heap = []
+
+    def purge(self, now=None):
+        """Drops the entries that have expired by ``now``."""
+        if now is None:
+            now = self.clock()
+
+        heap = self._bucket_heap
+        data = self._data
+        while heap and heap[0] * self.resolution <= now:
+            for key in self._buckets.pop(heappop(heap)):
+                entry = data.get(key)
+                # keys set again since are in a later bucket as well
+                if entry is not None and entry[0] <= now:
+                    del data[key]
+
+    def set(self, key, value, *, expires=None, now=None):
+        if now is None:
+            now = self.clock()
+        if expires is None:
+            expires = now + self.ttl
+
+        self.purge(now)
+        self._data[key] = (expires, value)
+
+        bucket = ceil(expires / self.resolution)
+        try:
+            self._buckets[bucket].add(key)
+        except KeyError:
+            self._buckets[bucket] = {key}
+            heappush(self._bucket_heap, bucket)
+
+    def get(self, key, default=None, *, now=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= (self.clock() if now is None else now):
+            return default
+        return entry[1]
+
+    def pop(self, key, default=_MISSING):
+        entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= self.clock():
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        return entry[1]
+
+    def items(self):
+        now = self.clock()
+        return [(key, value) for key, (expires, value) in self._data.items() if expires > now]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        # includes entries that expired since the last purge
+        return len(self._data)
+
+
+class ExpiringCooldownMapping(commands.CooldownMapping):
+    """A CooldownMapping whose buckets are kept in an :class:`ExpiringMap`.
+
+    The stock mapping scans every bucket for dead ones on each lookup, this
+    one only drops the buckets that have run out.
+    """
+
+    def __init__(self, original):
+        super().__init__(original)
+        self._cache = ExpiringMap(original.per, clock=time.time)
+
+    def _verify_cache_integrity(self, current=None):
+        self._cache.purge(current)
+
+    def get_bucket(self, message, current=None):
+        if self._cooldown.type is commands.BucketType.default:
+            return self._cooldown
+
+        current = current or time.time()
+        key = self._bucket_key(message)
+        bucket = self._cache.get(key, now=current)
+        if bucket is None:
+            bucket = self._cooldown.copy()
+
+        # the caller updates the bucket now, so it lives for another ``per``
+        self._cache.set(key, bucket, expires=current + bucket.per, now=current)
+        return bucket
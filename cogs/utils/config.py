@@ -12,7 +12,12 @@ def _create_encoder(cls):
     return type('_Encoder', (json.JSONEncoder,), { 'default': _default })
 
 class Config:
-    """The "database" object. Internally based on ``json``."""
+    """The "database" object. Internally based on ``json``.
+
+    With ``save_delay`` set, changes are saved at most once per that many
+    seconds instead of on every put/remove. Pass ``durable=True`` to write
+    a change out before returning, and call :meth:`flush` before exiting.
+    """
 
     def __init__(self, name, **options):
         self.name = name
@@ -29,6 +34,8 @@ class Config:
 
         self.loop = options.pop('loop', asyncio.get_event_loop())
         self.lock = asyncio.Lock()
+        self.save_delay = options.pop('save_delay', None)
+        self._pending_save = None
         if options.pop('load_later', False):
             self.loop.create_task(self.load())
         else:
@@ -57,19 +64,40 @@ class Config:
         async with self.lock:
             await self.loop.run_in_executor(None, self._dump)
 
+    async def _delayed_save(self):
+        await asyncio.sleep(self.save_delay)
+        # cleared first, so flush() waits on the lock instead of cancelling the write
+        self._pending_save = None
+        await self.save()
+
+    async def _changed(self, durable):
+        if self.save_delay is None or durable:
+            await self.flush(force=True)
+        elif self._pending_save is None:
+            self._pending_save = self.loop.create_task(self._delayed_save())
+
+    async def flush(self, *, force=False):
+        """Saves now if a delayed save is pending."""
+        if self._pending_save is not None:
+            self._pending_save.cancel()
+            self._pending_save = None
+        elif not force:
+            return
+        await self.save()
+
     def get(self, key, *args):
         """Retrieves a config entry."""
         return self._db.get(str(key), *args)
 
-    async def put(self, key, value, *args):
+    async def put(self, key, value, *args, durable=False):
         """Edits a config entry."""
         self._db[str(key)] = value
-        await self.save()
+        await self._changed(durable)
 
-    async def remove(self, key):
+    async def remove(self, key, *, durable=False):
         """Removes a config entry."""
         del self._db[str(key)]
-        await self.save()
+        await self._changed(durable)
 
     def __contains__(self, item):
         return str(item) in self._db
@@ -82,3 +110,205 @@ class Config:
 
     def all(self):
         return self._db
+
+class IdConfig:
+    """Like :class:`Config`, but keyed by Discord IDs as ints.
+
+    Lookups don't stringify the key, so ``user_id in config`` is a plain
+    dict membership check. Writes are appended to ``<name>.journal`` and only
+    folded back into ``name`` once ``compact_every`` of them have piled up.
+    ``name`` keeps the same JSON layout as :class:`Config`, so existing files
+    load as they are. ``save_delay`` and ``durable`` work as for :class:`Config`,
+    with the writes within the delay going out as one append.
+
+    Each compaction gives the snapshot a new generation under the
+    ``__generation__`` key, and a journal starts by naming the generation it
+    applies to. A journal left behind by a compaction that stopped before
+    removing it names an older generation, and is dropped instead of replayed.
+    """
+
+    GENERATION_KEY = '__generation__'
+
+    def __init__(self, name, *, compact_every=100, **options):
+        self.name = name
+        self.journal_name = f'{name}.journal'
+        self.compact_every = compact_every
+        self.loop = options.pop('loop', asyncio.get_event_loop())
+        self.lock = asyncio.Lock()
+        self.save_delay = options.pop('save_delay', None)
+        self._pending_save = None
+        self._pending_lines = []
+        # a durable write is waiting, so the next append is synced to disk
+        self._sync_pending = False
+        self._journal_entries = 0
+        self._generation = None
+        if options.pop('load_later', False):
+            self.loop.create_task(self.load())
+        else:
+            self.load_from_file()
+
+    def load_from_file(self):
+        try:
+            with open(self.name, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+
+        # files written before generations were added have none, nor do their journals
+        self._generation = data.pop(self.GENERATION_KEY, None)
+        self._db = {int(key): value for key, value in data.items()}
+
+        self._journal_entries = 0
+        try:
+            with open(self.journal_name, 'rb') as f:
+                current, torn_at = self._replay(f)
+        except FileNotFoundError:
+            return
+
+        if not current:
+            # the snapshot already holds everything in it
+            os.remove(self.journal_name)
+        elif torn_at is not None:
+            # cut off the write a crash left half done, so the next append
+            # starts on a line of its own instead of after the torn one
+            os.truncate(self.journal_name, torn_at)
+
+    def _replay(self, f):
+        """Applies the journal to ``_db``.
+
+        Returns whether the journal belongs to the current snapshot, and the
+        offset of a line torn by a crash or None.
+        """
+        generation = None
+        offset = 0
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('no newline')
+                op, key, value = json.loads(line)
+            except ValueError:
+                return True, offset
+            offset += len(line)
+
+            if op == 'generation':
+                generation = key
+            if generation != self._generation:
+                # checked before anything is applied, the header is the first line
+                return False, None
+
+            if op == 'put':
+                self._db[key] = value
+            elif op == 'remove':
+                self._db.pop(key, None)
+            else:
+                continue
+            self._journal_entries += 1
+        return True, None
+
+    async def load(self):
+        async with self.lock:
+            await self.loop.run_in_executor(None, self.load_from_file)
+
+    def _append(self, line, sync=False):
+        with open(self.journal_name, 'a', encoding='utf-8') as f:
+            if f.tell() == 0:
+                f.write(json.dumps(['generation', self._generation, None]) + '\n')
+            f.write(line)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _compact(self, data):
+        temp = '%s-%s.tmp' % (uuid.uuid4(), self.name)
+        with open(temp, 'w', encoding='utf-8') as tmp:
+            tmp.write(data)
+            # on disk before the journal, which may hold durable writes, is removed
+            tmp.flush()
+            os.fsync(tmp.fileno())
+
+        # atomically move the file, from here on the old journal names a
+        # stale generation, so stopping before it is removed loses nothing
+        os.replace(temp, self.name)
+        try:
+            os.remove(self.journal_name)
+        except FileNotFoundError:
+            pass
+
+    async def _write(self, op, key, value=None, durable=False):
+        line = json.dumps([op, key, value], ensure_ascii=True, separators=(',', ':')) + '\n'
+        self._pending_lines.append(line)
+        if durable:
+            self._sync_pending = True
+        if self.save_delay is None or durable:
+            await self.flush()
+        elif self._pending_save is None:
+            self._pending_save = self.loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.save_delay)
+        self._pending_save = None
+        await self.flush()
+
+    async def flush(self):
+        """Appends the writes still waiting on ``save_delay`` to the journal."""
+        if self._pending_save is not None:
+            self._pending_save.cancel()
+            self._pending_save = None
+
+        async with self.lock:
+            if not self._pending_lines:
+                return
+
+            lines, self._pending_lines = self._pending_lines, []
+            sync, self._sync_pending = self._sync_pending, False
+            await self.loop.run_in_executor(None, self._append, ''.join(lines), sync)
+            self._journal_entries += len(lines)
+            if self._journal_entries >= self.compact_every:
+                await self._save()
+
+    async def _save(self):
+        generation = uuid.uuid4().hex
+        # serialised here so the executor never sees the dict mid-update
+        data = json.dumps({self.GENERATION_KEY: generation, **self._db}, ensure_ascii=True, separators=(',', ':'))
+        # the snapshot already holds anything not yet journaled
+        self._pending_lines.clear()
+        await self.loop.run_in_executor(None, self._compact, data)
+        self._generation = generation
+        self._journal_entries = 0
+
+    async def save(self):
+        """Folds the journal into the main file."""
+        if self._pending_save is not None:
+            self._pending_save.cancel()
+            self._pending_save = None
+
+        async with self.lock:
+            await self._save()
+
+    def get(self, key, *args):
+        """Retrieves a config entry."""
+        return self._db.get(key, *args)
+
+    async def put(self, key, value, *args, durable=False):
+        """Edits a config entry."""
+        key = int(key)
+        self._db[key] = value
+        await self._write('put', key, value, durable)
+
+    async def remove(self, key, *, durable=False):
+        """Removes a config entry."""
+        key = int(key)
+        del self._db[key]
+        await self._write('remove', key, durable=durable)
+
+    def __contains__(self, item):
+        return item in self._db
+
+    def __getitem__(self, item):
+        return self._db[item]
+
+    def __len__(self):
+        return len(self._db)
+
+    def all(self):
+        return self._db
@@ -1,4 +1,5 @@
 from discord.ext import commands
+from time import perf_counter
 import discord
 import io
 
@@ -6,6 +7,11 @@ import io
 class Context(commands.Context):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        # seconds spent in each phase of the invocation, filled in by the stats
+        # cog's patches and send() below, the callback phase is what is left over
+        self.timings = {'check': 0.0, 'conversion': 0.0, 'send': 0.0}
+        # where the command was when it passed the slow command threshold
+        self.slow_stack = None
 
     def __repr__(self):
         # we need this for our cache key strategy
@@ -15,6 +21,19 @@ class Context(commands.Context):
     def session(self):
         return self.bot.session
 
+    async def send(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return await super().send(*args, **kwargs)
+        finally:
+            self.timings['send'] += perf_counter() - start
+
+    def capture_stack(self, task):
+        """Keeps the current stack of the task running this command."""
+        fp = io.StringIO()
+        task.print_stack(file=fp)
+        self.slow_stack = fp.getvalue()
+
     async def safe_send(self, content, *, escape_mentions=True, **kwargs):
         """Same as send except with some safe guards.
 
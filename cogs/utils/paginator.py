@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 import discord
 from discord.ext.commands import Paginator as CommandPaginator
 from discord.ext import menus
@@ -136,3 +137,145 @@ class SimplePages(RoboPages):
     def __init__(self, entries, *, per_page=12):
         super().__init__(SimplePageSource(entries, per_page=per_page))
         self.embed = discord.Embed(colour=discord.Colour.blurple())
+
+class LazyPageSource(menus.PageSource):
+    """A page source that only fetches the entries of the page being shown.
+
+    ``fetch(offset, limit)`` returns a page of entries and may be a coroutine
+    function, so it can slice an in-memory sequence or run a paginated query.
+    ``count`` is the total number of entries.
+    """
+    def __init__(self, fetch, count, *, per_page=12):
+        self.fetch = fetch
+        self.count = count
+        self.per_page = per_page
+
+        pages, left_over = divmod(count, per_page)
+        if left_over:
+            pages += 1
+
+        self._max_pages = pages
+
+    def is_paginating(self):
+        return self.count > self.per_page
+
+    def get_max_pages(self):
+        return self._max_pages
+
+    async def get_page(self, page_number):
+        entries = self.fetch(page_number * self.per_page, self.per_page)
+        if inspect.isawaitable(entries):
+            entries = await entries
+        return entries
+
+    async def format_page(self, menu, entries):
+        return '\n'.join(map(str, entries))
+
+class LazySimplePageSource(LazyPageSource):
+    """SimplePageSource on top of LazyPageSource.
+
+    ``formatter`` turns the fetched entries into the lines shown on the page.
+    """
+    def __init__(self, fetch, count, *, per_page=12, formatter=None):
+        super().__init__(fetch, count, per_page=per_page)
+        self.formatter = formatter
+        self.initial_page = True
+
+    async def format_page(self, menu, entries):
+        if self.formatter is not None:
+            entries = self.formatter(entries)
+
+        pages = []
+        for index, entry in enumerate(entries, start=menu.current_page * self.per_page):
+            pages.append(f'{index + 1}. {entry}')
+
+        maximum = self.get_max_pages()
+        if maximum > 1:
+            footer = f'Page {menu.current_page + 1}/{maximum} ({self.count} entries)'
+            menu.embed.set_footer(text=footer)
+
+        if self.initial_page and self.is_paginating():
+            pages.append('')
+            pages.append('Confused? React with \N{INFORMATION SOURCE} for more info.')
+            self.initial_page = False
+
+        menu.embed.description = '\n'.join(pages)
+        return menu.embed
+
+class IterTextPageSource(menus.PageSource):
+    """TextPageSource for an iterator of lines.
+
+    Lines are only pulled from the iterator as far as the page being shown,
+    so the page count is unknown until the last page has been reached.
+    """
+    def __init__(self, lines, *, prefix='```', suffix='```', heading=None, max_size=2000):
+        self.lines = iter(lines)
+        self.prefix = prefix
+        self.suffix = suffix
+        self.heading = heading
+        self.max_size = max_size - 200
+        self.pages = []
+        self.exhausted = False
+        self._pending = None
+
+    def _next_line(self):
+        if self._pending is not None:
+            line, self._pending = self._pending, None
+            return line
+        return next(self.lines, None)
+
+    def _build_page(self):
+        lines = [self.prefix]
+        size = len(self.prefix) + len(self.suffix) + 2
+        if self.heading and not self.pages:
+            lines.append(self.heading)
+            size += len(self.heading) + 1
+
+        while True:
+            line = self._next_line()
+            if line is None:
+                self.exhausted = True
+                break
+
+            line = line[:self.max_size - len(self.prefix) - len(self.suffix) - 2]
+            if size + len(line) + 1 > self.max_size and len(lines) > 1:
+                self._pending = line
+                break
+
+            lines.append(line)
+            size += len(line) + 1
+
+        if len(lines) > 1:
+            lines.append(self.suffix)
+            self.pages.append('\n'.join(lines))
+
+    async def prepare(self):
+        self._build_page()
+
+    def is_paginating(self):
+        return len(self.pages) > 1 or not self.exhausted
+
+    def get_max_pages(self):
+        return len(self.pages) if self.exhausted else None
+
+    async def get_page(self, page_number):
+        if page_number < 0:
+            raise IndexError(page_number)
+        while page_number >= len(self.pages) and not self.exhausted:
+            self._build_page()
+        return self.pages[page_number]
+
+    async def format_page(self, menu, content):
+        maximum = self.get_max_pages()
+        if maximum is None:
+            return f'{content}\nPage {menu.current_page + 1}'
+        if maximum > 1:
+            return f'{content}\nPage {menu.current_page + 1}/{maximum}'
+        return content
+
+class LazySimplePages(RoboPages):
+    """SimplePages for a LazySimplePageSource."""
+
+    def __init__(self, fetch, count, *, per_page=12, formatter=None):
+        super().__init__(LazySimplePageSource(fetch, count, per_page=per_page, formatter=formatter))
+        self.embed = discord.Embed(colour=discord.Colour.blurple())
@@ -0,0 +1,89 @@
+from array import array
+import json
+import struct
+import time
+
+# file header, then per event:
+# <timestamp: double><type length: uint8><payload length: uint32><ascii type><utf-8 payload>
+MAGIC = b'BEEREVT2'
+_RECORD = struct.Struct('<dBI')
+
+
+def _encode(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=repr).encode('utf-8')
+
+
+class EventRing:
+    """The last ``size`` gateway payloads with their type and the time they arrived.
+
+    Slots are allocated up front and each payload is kept as compact UTF-8
+    JSON, encoded when it is captured. That holds far less than the parsed
+    dicts would, and the parsers can't change a payload after the fact.
+    """
+
+    __slots__ = ('size', '_payloads', '_types', '_times', '_next', '_count')
+
+    def __init__(self, size):
+        self.size = size
+        self._payloads = [None] * size
+        self._types = [None] * size
+        self._times = array('d', bytes(8 * size))
+        self._next = 0
+        self._count = 0
+
+    def append(self, payload, event_type=None, timestamp=None):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif not isinstance(payload, bytes):
+            payload = _encode(payload)
+        index = self._next
+        self._payloads[index] = payload
+        self._types[index] = event_type
+        self._times[index] = time.time() if timestamp is None else timestamp
+        index += 1
+        self._next = 0 if index == self.size else index
+        if self._count < self.size:
+            self._count += 1
+
+    def capture(self, msg):
+        """Stores a ``socket_response`` payload, typed by its ``t``."""
+        self.append(_encode(msg), msg.get('t'))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """(timestamp, type, encoded payload) triples, oldest first."""
+        start = (self._next - self._count) % self.size if self.size else 0
+        for offset in range(self._count):
+            index = (start + offset) % self.size
+            yield self._times[index], self._types[index], self._payloads[index]
+
+    def dump(self, fp):
+        """Writes the events to the binary file object ``fp``."""
+        fp.write(MAGIC)
+        for timestamp, event_type, payload in self:
+            event_type = (event_type or '').encode('ascii', 'replace')[:255]
+            fp.write(_RECORD.pack(timestamp, len(event_type), len(payload)))
+            fp.write(event_type)
+            fp.write(payload)
+
+
+def read_dump(fp):
+    """Yields (timestamp, type, payload) triples from a file written by :meth:`EventRing.dump`.
+
+    ``type`` is None for payloads without one, e.g. heartbeat acks.
+    """
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not an event dump')
+
+    while True:
+        header = fp.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return
+        timestamp, type_length, length = _RECORD.unpack(header)
+        event_type = fp.read(type_length).decode('ascii')
+        payload = fp.read(length)
+        if len(payload) < length:
+            return
+        yield timestamp, event_type or None, payload.decode('utf-8')
@@ -0,0 +1,131 @@
+from collections import deque
+import asyncio
+import logging
+
+import discord
+
+log = logging.getLogger(__name__)
+
+# Discord's limits for a single webhook message
+MAX_CONTENT = 2000
+MAX_EMBEDS = 10
+MAX_EMBED_TOTAL = 6000
+
+
+class WebhookSink:
+    """Queues text lines and embeds for a webhook and sends them in batches.
+
+    At most one message goes out per ``interval`` seconds. Consecutive lines
+    with the same username and avatar are joined into one message, and
+    consecutive embeds share a message. Once ``max_queue`` items are
+    waiting, new ones are dropped and counted, and the count is reported
+    with the next message that goes out.
+    """
+
+    def __init__(self, webhook, *, interval=2.0, max_queue=500, loop=None):
+        self.webhook = webhook
+        self.interval = interval
+        self.max_queue = max_queue
+        self.loop = loop or asyncio.get_event_loop()
+        # (username, avatar_url, line) or (None, None, embed)
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._task = None
+        # dropped since the last notice, and over the sink's lifetime
+        self.dropped = 0
+        self.dropped_total = 0
+        self.sent = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _put(self, item):
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            self.dropped_total += 1
+            return
+        self._queue.append(item)
+        self._ready.set()
+
+    def send_line(self, line, *, username=None, avatar_url=None):
+        """Queues a line of text, must be called from the event loop."""
+        self._put((username, avatar_url, line[:MAX_CONTENT]))
+
+    def send_embed(self, embed):
+        """Queues an embed, must be called from the event loop."""
+        self._put((None, None, embed))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._worker())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _next_batch(self):
+        queue = self._queue
+        username, avatar_url, first = queue.popleft()
+        if isinstance(first, discord.Embed):
+            embeds = [first]
+            size = len(first)
+            while queue and len(embeds) < MAX_EMBEDS and isinstance(queue[0][2], discord.Embed):
+                size += len(queue[0][2])
+                if size > MAX_EMBED_TOTAL:
+                    break
+                embeds.append(queue.popleft()[2])
+            return {'embeds': embeds}
+
+        lines = [first]
+        size = len(first)
+        while queue:
+            next_username, next_avatar, line = queue[0]
+            if isinstance(line, discord.Embed) or (next_username, next_avatar) != (username, avatar_url):
+                break
+            size += len(line) + 1
+            if size > MAX_CONTENT:
+                break
+            lines.append(line)
+            queue.popleft()
+        return {'content': '\n'.join(lines), 'username': username, 'avatar_url': avatar_url}
+
+    async def _send_next(self):
+        kwargs = self._next_batch()
+        if self.dropped:
+            notice = f'\N{WARNING SIGN} {self.dropped} webhook message(s) dropped, the queue was full.'
+            content = kwargs.get('content')
+            if content is None or len(content) + len(notice) + 1 > MAX_CONTENT:
+                self._queue.appendleft((None, None, notice))
+            else:
+                kwargs['content'] = f'{content}\n{notice}'
+            self.dropped = 0
+
+        try:
+            await self.webhook.send(**kwargs)
+        except Exception:
+            # keep the worker alive, whatever the webhook or connection did
+            log.warning('Failed to send to the webhook', exc_info=True)
+        else:
+            self.sent += 1
+
+    async def _worker(self):
+        while True:
+            await self._ready.wait()
+            while self._queue:
+                await self._send_next()
+                await asyncio.sleep(self.interval)
+            self._ready.clear()
+
+    async def flush(self, *, max_sends=3):
+        """Sends what is waiting, up to ``max_sends`` messages, and drops the rest."""
+        self.stop()
+        for _ in range(max_sends):
+            if not self._queue:
+                return
+            await self._send_next()
+
+        if self._queue:
+            log.warning('Dropped %d webhook messages on shutdown', len(self._queue))
+            self.dropped_total += len(self._queue)
+            self._queue.clear()
@@ -1,18 +1,22 @@
 import asyncio
 import contextlib
+import copy
+import datetime
 import importlib
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
 import sys
 import traceback
 
 import click
 from munch import munchify
 import sqlalchemy
-from sqlalchemy import create_engine
 import yaml
 
 from bot import beeerbot, initial_extensions
+from cogs.utils.ring import read_dump
 from util import database
 
 
@@ -34,8 +38,49 @@ class RemoveNoise(logging.Filter):
         return True
 
 
+class LogQueueHandler(QueueHandler):
+    """Hands records to the QueueListener thread that does the formatting and I/O.
+
+    The message is merged with its args here, since they can be mutable objects
+    owned by the event loop, but the rest of the formatting is left to the
+    listener's handlers. Tracebacks are rendered now for the same reason.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log_format: json."""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        if record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
 @contextlib.contextmanager
-def setup_logging():
+def setup_logging(log_format='text'):
+    listener = None
     try:
         # __enter__
         max_bytes = 32 * 1024 * 1024 # 32 MiB
@@ -45,16 +90,30 @@ def setup_logging():
 
         log = logging.getLogger()
         log.setLevel(logging.INFO)
-        handler = RotatingFileHandler(filename='beeerbot.log', encoding='utf-8', mode='w', maxBytes=max_bytes, backupCount=5)
         dt_fmt = '%Y-%m-%d %H:%M:%S'
-        fmt = logging.Formatter('[{asctime}] [{levelname:<7}][{filename}:{lineno:<4}] {name}: {message}', dt_fmt, style='{')
+        if log_format == 'json':
+            handler = RotatingFileHandler(filename='beeerbot.jsonl', encoding='utf-8', mode='w', maxBytes=max_bytes, backupCount=5)
+            fmt = JsonFormatter(datefmt=dt_fmt)
+        else:
+            handler = RotatingFileHandler(filename='beeerbot.log', encoding='utf-8', mode='w', maxBytes=max_bytes, backupCount=5)
+            fmt = logging.Formatter('[{asctime}] [{levelname:<7}][{filename}:{lineno:<4}] {name}: {message}', dt_fmt, style='{')
         handler.setFormatter(fmt)
-        log.addHandler(handler)
+
+        # file writes happen on the listener's thread, not the event loop
+        listener = QueueListener(queue.SimpleQueue(), handler, respect_handler_level=True)
+        log.addHandler(LogQueueHandler(listener.queue))
+        listener.start()
         log.info("Launcher initialized")
 
         yield
     finally:
         # __exit__
+        if listener is not None:
+            # drains the queue before the file handler is closed
+            listener.stop()
+            for hdlr in listener.handlers:
+                hdlr.close()
+
         handlers = log.handlers[:]
         for hdlr in handlers:
             hdlr.close()
@@ -72,7 +131,8 @@ def main(ctx):
     """Launches the bot."""
     if ctx.invoked_subcommand is None:
         loop = asyncio.get_event_loop()
-        with setup_logging():
+        config = munchify(yaml.safe_load(open("config.yml")))
+        with setup_logging(config.bot_options.get('log_format', 'text')):
             run_bot()
 
 @main.group(short_help='database stuff', options_metavar='[options]')
@@ -85,7 +145,7 @@ def init(quiet):
     """Manage database creation"""
     config = munchify(yaml.safe_load(open("config.yml")))
     db_path = config.bot_options.get('database', 'sqlite:///cloudbot.db')
-    db_engine = create_engine(db_path, future=True)
+    db_engine, _ = database.create_engines(db_path)
 
     try:
         database.configure(db_engine, future=True)
@@ -104,5 +164,56 @@ def init(quiet):
     database.base.metadata.create_all(db_engine)
 
 
+@db.command(short_help='add missing indexes', options_metavar='[options]')
+@click.option('-q', '--quiet', help='less verbose output', is_flag=True)
+def migrate(quiet):
+    """Brings an existing database up to date with the models"""
+    config = munchify(yaml.safe_load(open("config.yml")))
+    db_path = config.bot_options.get('database', 'sqlite:///cloudbot.db')
+    db_engine, _ = database.create_engines(db_path)
+    database.configure(db_engine, future=True)
+
+    for ext in initial_extensions:
+        try:
+            importlib.import_module(ext)
+        except Exception:
+            click.echo(f'Could not load {ext}.\n{traceback.format_exc()}', err=True)
+            return
+
+    # new tables, then indexes added to tables that already existed
+    database.base.metadata.create_all(db_engine)
+    for table in database.base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db_engine, checkfirst=True)
+            if not quiet:
+                click.echo(f'{table.name}: {index.name}')
+
+
+@main.command(short_help='decode a gateway event dump', options_metavar='[options]')
+@click.argument('path', default='prev_events.bin')
+@click.option('-t', '--type', 'event_type', help='only show events of this type, e.g. MESSAGE_CREATE')
+@click.option('-n', '--last', type=int, help='only show the last N events')
+@click.option('--indent', is_flag=True, help='pretty-print the payloads')
+def events(path, event_type, last, indent):
+    """Prints the gateway events the bot wrote to prev_events.bin on exit"""
+    with open(path, 'rb') as f:
+        try:
+            records = list(read_dump(f))
+        except ValueError as e:
+            click.echo(f'{path}: {e}', err=True)
+            return
+
+    if event_type is not None:
+        records = [record for record in records if record[1] == event_type]
+    if last is not None:
+        records = records[-last:]
+
+    for timestamp, t, payload in records:
+        when = datetime.datetime.utcfromtimestamp(timestamp).isoformat(sep=' ', timespec='milliseconds')
+        if indent:
+            payload = json.dumps(json.loads(payload), ensure_ascii=True, indent=4)
+        click.echo(f'[{when}] {t or "-"} {payload}')
+
+
 if __name__ == '__main__':
     main()
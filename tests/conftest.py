@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from util import database
+
+
+@pytest.fixture
+def db():
+    """An in-memory SQLite database behind util.database, with every table created."""
+    # one shared connection, so the worker thread sees the same database
+    engine = create_engine(
+        'sqlite://', future=True, connect_args={'check_same_thread': False}, poolclass=StaticPool
+    )
+    database.configure(engine, future=True)
+    database.metadata.create_all(engine)
+    yield engine
+    database.configure(None)
+    engine.dispose()
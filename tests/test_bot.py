@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bot import _prefix_callable, beeerbot
+from cogs.utils.config import IdConfig
+
+
+class Crash(Exception):
+    pass
+
+
+def make_bot(prefixes):
+    bot = beeerbot.__new__(beeerbot)
+    bot.prefixes = prefixes
+    bot._mention_prefixes = None
+    bot._dm_prefixes = None
+    bot._guild_prefixes = {}
+    bot._connection = SimpleNamespace(user=SimpleNamespace(id=1))
+    return bot
+
+
+def test_prefixes_in_use_while_the_write_is_awaited(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    guild = SimpleNamespace(id=10)
+    msg = SimpleNamespace(guild=guild)
+
+    async def run():
+        prefixes = IdConfig('prefixes.json', loop=asyncio.get_running_loop())
+        bot = make_bot(prefixes)
+        assert _prefix_callable(bot, msg)[-1] == '!'
+        seen = []
+
+        async def write(*args, **kwargs):
+            # a message handled while the journal append is awaited
+            seen.append(_prefix_callable(bot, msg)[2:])
+            raise Crash()
+
+        monkeypatch.setattr(prefixes, '_write', write)
+        with pytest.raises(Crash):
+            await bot.set_guild_prefixes(guild, ['?'])
+
+        assert seen == [('?',)]
+        assert guild.id not in bot._guild_prefixes
+
+    asyncio.run(run())
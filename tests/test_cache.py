@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import pytest
+from discord.ext import commands
+
+from cogs.utils.cache import ExpiringCooldownMapping, ExpiringMap
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock(100.0)
+    cache = ExpiringMap(10.0, clock=clock)
+    cache['a'] = 1
+    cache.set('b', 2, expires=105.0)
+
+    assert cache['a'] == 1 and 'b' in cache
+    assert sorted(cache.items()) == [('a', 1), ('b', 2)]
+
+    clock.now = 105.0
+    assert 'b' not in cache
+    assert cache.get('b', 'gone') == 'gone'
+    assert cache.items() == [('a', 1)]
+    # not purged yet, only hidden
+    assert len(cache) == 2
+
+    clock.now = 110.0
+    with pytest.raises(KeyError):
+        cache['a']
+    cache.purge()
+    assert len(cache) == 0
+
+
+def test_purge_keeps_keys_set_again():
+    clock = Clock(0.0)
+    cache = ExpiringMap(10.0, resolution=5.0, clock=clock)
+    cache['a'] = 1
+    clock.now = 8.0
+    cache['a'] = 2
+    cache['b'] = 3
+
+    # a's first bucket has run out, but it was set again since
+    cache.purge(12.0)
+    assert len(cache) == 2
+    assert cache.get('a', now=12.0) == 2
+
+    cache.purge(20.0)
+    assert len(cache) == 0
+
+
+def test_pop():
+    clock = Clock(0.0)
+    cache = ExpiringMap(10.0, clock=clock)
+    cache['a'] = 1
+    cache['b'] = 2
+
+    assert cache.pop('a') == 1
+    assert 'a' not in cache
+    assert cache.pop('a', None) is None
+    del cache['b']
+    with pytest.raises(KeyError):
+        del cache['b']
+
+    cache['c'] = 3
+    clock.now = 10.0
+    with pytest.raises(KeyError):
+        cache.pop('c')
+
+
+def test_cooldown_buckets_are_reused_until_they_run_out():
+    mapping = ExpiringCooldownMapping.from_cooldown(2, 12.0, commands.BucketType.user)
+    message = SimpleNamespace(author=SimpleNamespace(id=1))
+    other = SimpleNamespace(author=SimpleNamespace(id=2))
+
+    bucket = mapping.get_bucket(message, 1000.0)
+    assert not bucket.update_rate_limit(1000.0)
+    assert mapping.get_bucket(message, 1005.0) is bucket
+    assert not bucket.update_rate_limit(1005.0)
+    assert mapping.get_bucket(other, 1005.0) is not bucket
+
+    assert mapping.get_bucket(message, 1010.0) is bucket
+    assert bucket.update_rate_limit(1010.0)
+
+    # each lookup keeps the bucket for another ``per`` seconds
+    mapping._verify_cache_integrity(1021.0)
+    assert len(mapping._cache) == 1
+    assert mapping.get_bucket(message, 1021.0) is bucket
+    mapping._verify_cache_integrity(1033.0)
+    assert len(mapping._cache) == 0
+    assert mapping.get_bucket(message, 1033.0) is not bucket
@@ -0,0 +1,157 @@
+import asyncio
+import os
+
+from cogs.utils import config
+
+
+class Crash(Exception):
+    pass
+
+
+def test_journal_is_not_replayed_over_a_newer_snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def write():
+        ids = config.IdConfig('ids.json', save_delay=60.0, loop=asyncio.get_running_loop())
+        await ids.put(1, 'one', durable=True)
+        await ids.put(2, 'two', durable=True)
+        # only in the snapshot, never journaled
+        await ids.remove(1)
+
+        def crash(path):
+            raise Crash(path)
+
+        # stop between replacing the snapshot and removing the journal
+        with monkeypatch.context() as m:
+            m.setattr(config.os, 'remove', crash)
+            try:
+                await ids.save()
+            except Crash:
+                pass
+
+    asyncio.run(write())
+    assert os.path.exists('ids.json.journal')
+
+    async def reload():
+        ids = config.IdConfig('ids.json', loop=asyncio.get_running_loop())
+        assert ids.all() == {2: 'two'}
+        await ids.put(3, 'three')
+
+    asyncio.run(reload())
+
+    async def reload_again():
+        ids = config.IdConfig('ids.json', loop=asyncio.get_running_loop())
+        assert ids.all() == {2: 'two', 3: 'three'}
+
+    asyncio.run(reload_again())
+
+
+def test_files_without_a_generation_still_load(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'ids.json').write_text('{"1":"one","2":"two"}')
+    (tmp_path / 'ids.json.journal').write_text('["remove",1,null]\n["put",3,"three"]\n')
+
+    async def load():
+        ids = config.IdConfig('ids.json', loop=asyncio.get_running_loop())
+        assert ids.all() == {2: 'two', 3: 'three'}
+
+    asyncio.run(load())
+
+
+def test_torn_journal_line_is_cut_off(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'ids.json.journal').write_text('["generation",null,null]\n["put",1,"one"]\n["put",2,"tw')
+
+    async def write():
+        ids = config.IdConfig('ids.json', loop=asyncio.get_running_loop())
+        assert ids.all() == {1: 'one'}
+
+        async def crash():
+            raise Crash()
+
+        # stop before any compaction, the new write must stand on its own in the journal
+        monkeypatch.setattr(ids, '_save', crash)
+        await ids.put(3, 'three')
+
+    asyncio.run(write())
+
+    async def reload():
+        ids = config.IdConfig('ids.json', loop=asyncio.get_running_loop())
+        assert ids.all() == {1: 'one', 3: 'three'}
+
+    asyncio.run(reload())
+
+
+def test_durable_writes_are_synced(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    synced = []
+    monkeypatch.setattr(config.os, 'fsync', synced.append)
+
+    async def write():
+        ids = config.IdConfig('ids.json', save_delay=60.0, loop=asyncio.get_running_loop())
+        await ids.put(1, 'one')
+        await ids.flush()
+        assert not synced
+        await ids.put(2, 'two', durable=True)
+        assert len(synced) == 1
+
+    asyncio.run(write())
+
+
+def test_config_saves_are_debounced(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        conf = config.Config('conf.json', save_delay=0.05, loop=asyncio.get_running_loop())
+        dumps = []
+        dump = conf._dump
+        monkeypatch.setattr(conf, '_dump', lambda: dumps.append(dict(conf._db)) or dump())
+
+        await conf.put('a', 1)
+        await conf.put('b', 2)
+        await conf.remove('a')
+        assert dumps == []
+        await asyncio.sleep(0.1)
+        assert dumps == [{'b': 2}]
+
+        await conf.put('c', 3, durable=True)
+        assert dumps[-1] == {'b': 2, 'c': 3}
+
+        await conf.put('d', 4)
+        await conf.flush()
+        assert len(dumps) == 3
+        # nothing pending, so nothing to write
+        await conf.flush()
+        assert len(dumps) == 3
+
+    asyncio.run(run())
+
+    async def reload():
+        conf = config.Config('conf.json', loop=asyncio.get_running_loop())
+        assert conf.all() == {'b': 2, 'c': 3, 'd': 4}
+
+    asyncio.run(reload())
+
+
+def test_id_config_journal_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        ids = config.IdConfig('ids.json', compact_every=3, loop=asyncio.get_running_loop())
+        await ids.put('1', 'one')
+        await ids.put(2, 'two')
+        assert 1 in ids and '1' not in ids
+        assert os.path.exists('ids.json.journal') and not os.path.exists('ids.json')
+
+        await ids.remove(1)
+        # the third write folds the journal into the snapshot
+        assert not os.path.exists('ids.json.journal')
+        assert ids.all() == {2: 'two'}
+
+    asyncio.run(run())
+
+    async def reload():
+        ids = config.IdConfig('ids.json', loop=asyncio.get_running_loop())
+        assert ids.all() == {2: 'two'}
+
+    asyncio.run(reload())
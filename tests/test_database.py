@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, select
+from sqlalchemy.orm import Session
+
+from util import database
+
+metadata = MetaData()
+scores = Table(
+    'scores',
+    metadata,
+    Column('name', String(25), primary_key=True),
+    Column('chan', String(25), primary_key=True),
+    Column('shot', Integer),
+    Column('note', String(25)),
+)
+
+
+@pytest.fixture(params=['on conflict', 'fallback'])
+def session(request, db, monkeypatch):
+    if request.param == 'fallback':
+        # as on a dialect without INSERT ... ON CONFLICT
+        monkeypatch.setattr(database, '_UPSERT_INSERTS', {})
+    metadata.create_all(db)
+    with Session(db, future=True) as session:
+        yield session
+
+
+def read(session):
+    return session.execute(select(scores).order_by(scores.c.name, scores.c.chan)).all()
+
+
+def test_upsert_inserts_and_updates(session):
+    rows = [
+        {'name': 'bob', 'chan': '1', 'shot': 1, 'note': 'a'},
+        {'name': 'amy', 'chan': '1', 'shot': 2, 'note': 'b'},
+    ]
+    database.upsert(session, scores, rows, ('name', 'chan'), replace=('note',), increment=('shot',))
+    database.upsert(
+        session, scores, [{'name': 'bob', 'chan': '1', 'shot': 3, 'note': 'c'}],
+        ('name', 'chan'), replace=('note',), increment=('shot',),
+    )
+    session.commit()
+    assert read(session) == [('amy', '1', 2, 'b'), ('bob', '1', 4, 'c')]
+
+
+def test_upsert_without_columns_to_update_keeps_the_row(session):
+    database.upsert(session, scores, [{'name': 'bob', 'chan': '1', 'shot': 1, 'note': 'a'}], ('name', 'chan'))
+    database.upsert(session, scores, [{'name': 'bob', 'chan': '1', 'shot': 5, 'note': 'b'}], ('name', 'chan'))
+    session.commit()
+    assert read(session) == [('bob', '1', 1, 'a')]
+
+
+def test_upsert_with_no_rows_does_nothing(session):
+    database.upsert(session, scores, [], ('name', 'chan'), increment=('shot',))
+    assert read(session) == []
@@ -0,0 +1,252 @@
+import asyncio
+from collections import defaultdict
+import logging
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from cogs.duckhunt import ChannelState, Duckhunt, DuckHuntTable, DuckSettings, Leaderboard, ScoreBuffer, ScoreIndex
+from util import database
+
+
+def make_cog():
+    cog = Duckhunt.__new__(Duckhunt)
+    cog.log = logging.getLogger(__name__)
+    cog.table = DuckHuntTable
+    cog.score_buffer = ScoreBuffer()
+    cog.flush_lock = asyncio.Lock()
+    return cog
+
+
+def read_scores(session):
+    table = DuckHuntTable
+    return session.execute(
+        select(table.network, table.chan, table.name, table.shot, table.befriend).order_by(table.chan, table.name)
+    ).all()
+
+
+def test_score_buffer_sums_changes_per_key():
+    buffer = ScoreBuffer()
+    key = buffer.make_key(1, 10, 'bob')
+    assert key == ('1', '10', 'bob')
+
+    buffer.add(key, shoot=1)
+    buffer.add(key, friend=1)
+    buffer.add(key, shoot=2)
+    buffer.add(buffer.make_key(1, 11, 'bob'), friend=1)
+    assert len(buffer) == 2
+    assert buffer.get(key) == [3, 1]
+    assert buffer.get(buffer.make_key(2, 10, 'bob')) == [0, 0]
+
+
+def test_score_buffer_take_and_restore():
+    buffer = ScoreBuffer()
+    key = buffer.make_key(1, 10, 'bob')
+    buffer.add(key, shoot=2)
+
+    batch = buffer.take()
+    assert batch == {key: [2, 0]}
+    assert len(buffer) == 0
+
+    # a hit that lands while the failed batch was being written
+    buffer.add(key, shoot=1, friend=1)
+    buffer.restore(batch)
+    assert buffer.take() == {key: [3, 1]}
+
+
+
+def test_flush_writes_the_buffer_once(db):
+    async def run():
+        cog = make_cog()
+        buffer = cog.score_buffer
+        buffer.add(buffer.make_key(1, 10, 'bob'), shoot=1)
+        await cog.flush_scores()
+        buffer.add(buffer.make_key(1, 10, 'bob'), shoot=1, friend=1)
+        buffer.add(buffer.make_key(1, 11, 'amy'), friend=1)
+        await cog.flush_scores()
+        # nothing left to write
+        await cog.flush_scores()
+
+        assert len(buffer) == 0
+        assert await database.run(read_scores) == [('1', '10', 'bob', 2, 1), ('1', '11', 'amy', 0, 1)]
+
+    asyncio.run(run())
+
+
+def test_failed_flush_keeps_the_changes(db):
+    async def run():
+        cog = make_cog()
+        buffer = cog.score_buffer
+        buffer.add(buffer.make_key(1, 10, 'bob'), shoot=1)
+
+        def fail(session, batch):
+            raise RuntimeError('database went away')
+
+        cog._write_scores = fail
+        await cog.flush_scores()
+        assert buffer.get(buffer.make_key(1, 10, 'bob')) == [1, 0]
+
+        del cog._write_scores
+        await cog.flush_scores()
+        assert await database.run(read_scores) == [('1', '10', 'bob', 1, 0)]
+
+    asyncio.run(run())
+
+
+def make_scheduler(**options):
+    cog = Duckhunt.__new__(Duckhunt)
+    cog.settings = DuckSettings(options)
+    cog.game_status = defaultdict(lambda: defaultdict(lambda: ChannelState(cog.settings)))
+    cog.duck_timers = []
+    cog.duck_timer_wakeup = asyncio.Event()
+    cog.deployed = []
+
+    async def deploy(chan, status):
+        cog.deployed.append(chan)
+        status.duck_status = 1
+
+    cog.deploy = deploy
+    return cog
+
+
+def test_duck_timers_come_out_in_due_order():
+    async def run():
+        # due straight away
+        cog = make_scheduler(min_ducktime=-10, max_ducktime=-10, min_lines=0, min_users=0)
+        for channel_id in (3, 1, 2):
+            cog.get_state_table(1, channel_id).game_on = True
+            cog.set_ducktime(channel_id, 1)
+        assert cog.duck_timer_wakeup.is_set()
+
+        await Duckhunt.deploy_duck.coro(cog)
+        assert sorted(cog.deployed) == [1, 2, 3]
+        assert cog.duck_timers == []
+
+    asyncio.run(run())
+
+
+def test_duck_timers_skip_stale_and_stopped_channels():
+    async def run():
+        cog = make_scheduler(min_ducktime=-10, max_ducktime=-10, min_lines=0, min_users=0)
+        cog.get_state_table(1, 1).game_on = True
+        cog.set_ducktime(1, 1)
+        # rescheduled, the first timer no longer matches next_duck_time
+        cog.settings.update({'min_ducktime': 3600, 'max_ducktime': 3600})
+        cog.set_ducktime(1, 1)
+        # game stopped after it was scheduled
+        cog.settings.update({'min_ducktime': -10, 'max_ducktime': -10})
+        cog.set_ducktime(2, 1)
+
+        await Duckhunt.deploy_duck.coro(cog)
+        assert cog.deployed == []
+        assert not cog.get_state_table(1, 1).duck_due
+        # only the rescheduled timer is left
+        assert len(cog.duck_timers) == 1
+
+    asyncio.run(run())
+
+
+def test_due_duck_waits_for_a_busy_channel():
+    async def run():
+        cog = make_scheduler(min_ducktime=-10, max_ducktime=-10, min_lines=2, min_users=2)
+        cog.opt_out = defaultdict(list)
+        status = cog.get_state_table(1, 1)
+        status.game_on = True
+        cog.set_ducktime(1, 1)
+
+        await Duckhunt.deploy_duck.coro(cog)
+        assert status.duck_due and cog.deployed == []
+
+        for author_id in (1, 2):
+            message = SimpleNamespace(
+                guild=SimpleNamespace(id=1), channel=SimpleNamespace(id=1), author=SimpleNamespace(id=author_id)
+            )
+            await cog.increment_msg_counter(message)
+        assert cog.deployed == [1]
+
+    asyncio.run(run())
+
+
+def test_channel_state_tracks_speakers_up_to_min_users():
+    settings = DuckSettings({'min_users': 2})
+    status = ChannelState(settings)
+    status.handle_message(1)
+    # not counted while the game is off
+    assert status.messages == 0
+
+    status.game_on = True
+    for author_id in (1, 1, 2, 3, 4):
+        status.handle_message(author_id)
+    assert status.messages == 5
+    assert status.masks == {1, 2}
+
+    status.clear_messages()
+    assert status.messages == 0 and not status.masks
+
+
+def test_leaderboard_stays_ranked():
+    board = Leaderboard()
+    board.add('bob', 2)
+    board.add('amy', 3)
+    board.add('cat', 2)
+    assert board.top() == [('amy', 3), ('bob', 2), ('cat', 2)]
+    assert board[0] == 'amy: 3'
+    assert board[1:] == ['bob: 2', 'cat: 2']
+
+    board.add('cat', 2)
+    board.set('amy', 0)
+    assert board.top() == [('cat', 4), ('bob', 2)]
+    assert len(board) == 2
+    assert board.get('amy') == 0
+
+
+def test_score_index_totals_and_averages():
+    index = ScoreIndex()
+    index.add('1', '10', 'bob', shot=4)
+    index.add('1', '11', 'bob', shot=2, befriend=1)
+    index.add('1', '10', 'amy', shot=1)
+    index.add('2', '10', 'bob', shot=9)
+
+    assert index.get('1', '10', 'bob') == (4, 0)
+    assert index.channel_board('shot', '1', '10').top() == [('bob', 4), ('amy', 1)]
+    assert index.total_board('shot', '1').top() == [('bob', 6), ('amy', 1)]
+    assert index.average_board('shot', '1').top() == [('bob', 3), ('amy', 1)]
+    assert index.total_board('befriend', '1').top() == [('bob', 1)]
+
+    # a merge moves the score away, the channel stops counting towards bob's average
+    index.add('1', '11', 'bob', shot=-2, befriend=-1)
+    assert index.average_board('shot', '1').get('bob') == 4
+    assert index.total_board('befriend', '1').top() == []
+    assert len(index.channel_board('shot', '3', '10')) == 0
+
+
+def test_score_buffer_channel_deltas():
+    buffer = ScoreBuffer()
+    buffer.add(buffer.make_key(1, 10, 'bob'), shoot=1)
+    buffer.add(buffer.make_key(1, 10, 'amy'), shoot=2, friend=1)
+    buffer.add(buffer.make_key(1, 11, 'bob'), friend=3)
+    buffer.add(buffer.make_key(2, 10, 'bob'), shoot=5)
+
+    assert buffer.channel_deltas('1') == {'10': [3, 1], '11': [0, 3]}
+    assert buffer.channel_deltas('1', 'bob') == {'10': [1, 0], '11': [0, 3]}
+    assert buffer.channel_deltas('3') == {}
+
+
+def test_channel_scores_add_what_is_still_buffered(db):
+    async def run():
+        cog = make_cog()
+        buffer = cog.score_buffer
+        buffer.add(buffer.make_key(1, 10, 'bob'), shoot=3, friend=1)
+        buffer.add(buffer.make_key(1, 11, 'amy'), friend=2)
+        buffer.add(buffer.make_key(2, 10, 'bob'), shoot=5)
+        await cog.flush_scores()
+
+        buffer.add(buffer.make_key(1, 10, 'bob'), shoot=1)
+        buffer.add(buffer.make_key(1, 12, 'bob'), friend=4)
+
+        assert await cog.channel_scores(1, 'bob') == {'10': [4, 1], '12': [0, 4]}
+        assert await cog.channel_scores(1) == {'10': [4, 1], '11': [0, 2], '12': [0, 4]}
+        # answered without writing the buffer out
+        assert len(buffer) == 2
+
+    asyncio.run(run())
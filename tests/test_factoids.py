@@ -0,0 +1,190 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from cogs.factoids import FactoidCache, Factoids, FactoidTemplate, GuildFactoids
+
+
+def make_cog():
+    bot = SimpleNamespace(config=SimpleNamespace(bot_options={}))
+    return Factoids(bot)
+
+
+def test_guild_with_rows_keeps_the_defaults(db):
+    async def run():
+        cog = make_cog()
+        await cog.add_factoid('beer', '1', 'is cold', 'someone')
+        cog.factoid_cache.clear()
+
+        facts = await cog.factoid_cache.get('1')
+        assert facts['beer'].raw == 'is cold'
+        assert facts['beeerbot'].raw == 'is the best'
+
+    asyncio.run(run())
+
+
+def test_write_during_a_cold_load_is_not_lost(db):
+    async def run():
+        cog = make_cog()
+        read = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_load(chan):
+            facts = await cog.load_guild(chan)
+            read.set()
+            await release.wait()
+            return facts
+
+        cog.factoid_cache.loader = slow_load
+        loading = asyncio.create_task(cog.factoid_cache.get('1'))
+        await read.wait()
+        # the load has already read the rows this write changes
+        await cog.add_factoid('beer', '1', 'is cold', 'someone')
+        release.set()
+        await loading
+
+        facts = await cog.factoid_cache.get('1')
+        assert facts['beer'].raw == 'is cold'
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_write_to_an_evicted_guild_is_read_back(db):
+    async def run():
+        cog = make_cog()
+        cog.factoid_cache.max_guilds = 1
+        await cog.add_factoid('beer', '1', 'is cold', 'someone')
+        await cog.factoid_cache.get('1')
+        await cog.factoid_cache.get('2')
+        assert cog.factoid_cache.peek('1') is None
+
+        await cog.add_factoid('beer', '1', 'is warm', 'someone')
+        await cog.del_factoid('1', ['beeerbot'])
+        facts = await cog.factoid_cache.get('1')
+        assert facts['beer'].raw == 'is warm'
+        assert facts['beeerbot'].raw == 'is the best'
+
+    asyncio.run(run())
+
+
+def test_max_width_follows_adds_and_removes():
+    facts = GuildFactoids({'beer': FactoidTemplate('x')})
+    assert facts.max_width == 4
+
+    # wide characters take two columns each
+    facts['ビール'] = FactoidTemplate('x')
+    assert facts.max_width == 6
+    facts['ビア'] = FactoidTemplate('x')
+    facts.pop('ビール')
+    assert facts.max_width == 4
+    facts.pop('ビア')
+    facts.pop('beer')
+    assert facts.max_width == 0
+
+    cog = make_cog()
+    assert cog.get_max_size(GuildFactoids({'beer': FactoidTemplate('x'), 'ビール': FactoidTemplate('x')})) == 7
+
+
+def test_factoid_cache_evicts_the_least_recently_used_guild():
+    async def run():
+        loads = []
+
+        async def loader(guild_id):
+            loads.append(guild_id)
+            return GuildFactoids({})
+
+        cache = FactoidCache(loader, max_guilds=2)
+        await cache.get('1')
+        await cache.get('2')
+        # touching 1 makes 2 the oldest
+        assert cache.peek('1') is not None
+        await cache.get('3')
+
+        assert list(cache.guilds) == ['1', '3']
+        assert cache.evictions == 1
+        await cache.get('2')
+        assert loads == ['1', '2', '3', '2']
+        assert (cache.hits, cache.misses) == (1, 4)
+
+    asyncio.run(run())
+
+
+def test_factoid_cache_shares_concurrent_loads():
+    async def run():
+        loads = []
+
+        async def loader(guild_id):
+            loads.append(guild_id)
+            await asyncio.sleep(0)
+            return GuildFactoids({})
+
+        cache = FactoidCache(loader)
+        first, second = await asyncio.gather(cache.get('1'), cache.get('1'))
+        assert first is second
+        assert loads == ['1']
+
+    asyncio.run(run())
+
+
+def test_factoid_cache_failed_load_is_retried():
+    async def run():
+        calls = []
+
+        async def loader(guild_id):
+            calls.append(guild_id)
+            if len(calls) == 1:
+                raise RuntimeError('database went away')
+            return GuildFactoids({})
+
+        cache = FactoidCache(loader)
+        with pytest.raises(RuntimeError):
+            await cache.get('1')
+        assert cache.peek('1') is None
+        await cache.get('1')
+        assert calls == ['1', '1']
+
+    asyncio.run(run())
+
+
+def test_factoid_template_fills_placeholders():
+    message = SimpleNamespace(author=SimpleNamespace(display_name='amy'), channel=SimpleNamespace(name='bar'))
+    template = FactoidTemplate('<nick> hands <user> a beer in <channel>, <arg2> pays')
+    assert template.slots == {'nick', 'user', 'channel', 'arg2'}
+    assert template.render(message, ['bob', 'cat']) == 'amy hands bob a beer in bar, cat pays'
+    # placeholders without a value are left as typed
+    assert template.render(message, []) == 'amy hands <user> a beer in bar, <arg2> pays'
+
+
+def test_factoid_template_act_and_plain_text():
+    message = SimpleNamespace(author=SimpleNamespace(display_name='amy'), channel=SimpleNamespace(name='bar'))
+    act = FactoidTemplate('<act> pours <user> a pint')
+    assert act.act
+    assert act.render(message, ['bob']) == '*pours bob a pint*'
+
+    plain = FactoidTemplate('is the best <unknown>')
+    assert not plain.slots
+    assert plain.render(message, ['bob']) == 'is the best <unknown>'
+
+
+def test_guild_factoids_keep_names_sorted():
+    facts = GuildFactoids({name: FactoidTemplate('x') for name in ('beer', 'ale', 'beers')})
+    facts['bee'] = FactoidTemplate('x')
+    facts['beer'] = FactoidTemplate('y')
+    assert facts.words == ['ale', 'bee', 'beer', 'beers']
+    assert facts.pop('ale').raw == 'x'
+    assert facts.pop('ale', 'gone') == 'gone'
+    assert [word for word, _ in facts.items()] == ['bee', 'beer', 'beers']
+
+    assert facts.with_prefix('beer') == ['beer', 'beers']
+    assert facts.with_prefix('be', limit=2) == ['bee', 'beer']
+    assert facts.with_prefix('cider') == []
+
+
+def test_guild_factoids_suggest_close_names():
+    facts = GuildFactoids({name: FactoidTemplate('x') for name in ('beer', 'beers', 'coffee', 'tea')})
+    assert facts.suggest('beeer') == ['beer', 'beers']
+    assert facts.suggest('cofee') == ['coffee']
+    # too short to guess at, and a different first letter isn't looked at
+    assert facts.suggest('te') == []
+    assert facts.suggest('xoffee') == []
@@ -0,0 +1,78 @@
+import pytest
+
+from util.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_registry_rejects_duplicate_names():
+    registry = Registry()
+    Counter("things_total", "Things", registry=registry)
+    with pytest.raises(ValueError):
+        Gauge("things_total", "Things again", registry=registry)
+    assert isinstance(registry.get("things_total"), Counter)
+
+
+def test_labels_are_checked_and_reused():
+    registry = Registry()
+    counter = Counter("events_total", "Events", ["type"], registry=registry)
+    child = counter.labels("READY")
+    assert counter.labels("READY") is child
+    with pytest.raises(ValueError):
+        counter.labels("READY", "extra")
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+def test_counter_and_gauge_render():
+    registry = Registry()
+    counter = Counter("messages_total", "Messages", ["result"], registry=registry)
+    counter.labels("passed").inc()
+    counter.labels("passed").inc(2)
+    counter.labels('say "hi"\n').inc()
+
+    gauge = Gauge("queue_depth", "Queued", ["queue"], registry=registry)
+    gauge.labels("a").set(5)
+    gauge.labels("a").dec()
+    gauge.labels("b").set_function(lambda: 1.5)
+    gauge.labels("gone").set_function(lambda: 1 / 0)
+
+    assert registry.render().splitlines() == [
+        "# HELP messages_total Messages",
+        "# TYPE messages_total counter",
+        'messages_total{result="passed"} 3',
+        'messages_total{result="say \\"hi\\"\\n"} 1',
+        "# HELP queue_depth Queued",
+        "# TYPE queue_depth gauge",
+        'queue_depth{queue="a"} 4',
+        'queue_depth{queue="b"} 1.5',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = Histogram("latency_seconds", "Latency", buckets=(1.0, 0.1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+    child = histogram.labels()
+    assert child.quantile(0.5) == 0.1
+    assert child.quantile(0.75) == 1.0
+    assert child.quantile(1.0) == float("inf")
+
+
+def test_histogram_time():
+    histogram = Histogram("op_seconds", "Op", ["op"], registry=None)
+    with histogram.labels("read").time():
+        pass
+    with pytest.raises(RuntimeError):
+        with histogram.labels("read").time():
+            raise RuntimeError
+    assert histogram.labels("read").count == 2
@@ -0,0 +1,86 @@
+import asyncio
+
+import discord
+
+from cogs.utils.paginator import IterTextPageSource, LazyPageSource, LazySimplePageSource
+
+
+class Menu:
+    def __init__(self, current_page=0):
+        self.current_page = current_page
+        self.embed = discord.Embed()
+
+
+def test_lazy_page_source_fetches_only_the_page_shown():
+    async def run():
+        entries = [f'entry {i}' for i in range(25)]
+        fetched = []
+
+        async def fetch(offset, limit):
+            fetched.append((offset, limit))
+            return entries[offset:offset + limit]
+
+        source = LazyPageSource(fetch, len(entries), per_page=10)
+        assert source.get_max_pages() == 3
+        assert source.is_paginating()
+        assert await source.get_page(2) == entries[20:]
+        assert fetched == [(20, 10)]
+        assert await source.format_page(Menu(2), ['a', 'b']) == 'a\nb'
+
+        # a plain function works as well
+        source = LazyPageSource(lambda offset, limit: entries[offset:offset + limit], 5, per_page=10)
+        assert source.get_max_pages() == 1
+        assert not source.is_paginating()
+        assert await source.get_page(0) == entries[:10]
+
+    asyncio.run(run())
+
+
+def test_lazy_simple_page_source_numbers_across_pages():
+    async def run():
+        source = LazySimplePageSource(
+            lambda offset, limit: list(range(offset, offset + limit)), 30, per_page=10,
+            formatter=lambda entries: [f'#{n}' for n in entries],
+        )
+        source.initial_page = False
+        menu = Menu(1)
+        embed = await source.format_page(menu, await source.get_page(1))
+        lines = embed.description.split('\n')
+        assert lines[0] == '11. #10'
+        assert lines[-1] == '20. #19'
+        assert embed.footer.text == 'Page 2/3 (30 entries)'
+
+    asyncio.run(run())
+
+
+def test_iter_text_page_source_pulls_lines_as_pages_are_shown():
+    async def run():
+        pulled = []
+
+        def lines():
+            for i in range(100):
+                pulled.append(i)
+                yield f'line {i:03} ' + 'x' * 40
+
+        source = IterTextPageSource(lines(), heading='Facts:', max_size=600)
+        await source.prepare()
+        first = await source.get_page(0)
+        assert first.startswith('```\nFacts:\nline 000')
+        assert source.get_max_pages() is None
+        assert len(pulled) < 100
+        assert await source.format_page(Menu(0), first) == f'{first}\nPage 1'
+
+        last = None
+        page = 1
+        while source.get_max_pages() is None:
+            last = await source.get_page(page)
+            page += 1
+        assert len(pulled) == 100
+        assert 'line 099' in last
+        assert len(source.pages) == source.get_max_pages()
+        # every line is on exactly one page
+        text = '\n'.join(source.pages)
+        assert all(text.count(f'line {i:03} ') == 1 for i in range(100))
+        assert all(len(p) <= 400 for p in source.pages)
+
+    asyncio.run(run())
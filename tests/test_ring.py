@@ -0,0 +1,82 @@
+import asyncio
+import io
+import json
+import zlib
+
+from discord.gateway import DiscordWebSocket
+
+from cogs.utils.ring import EventRing, read_dump
+
+
+def make_ws(ring):
+    ws = DiscordWebSocket.__new__(DiscordWebSocket)
+    ws._dispatch = lambda event, *args: ring.capture(args[0]) if event == 'socket_response' else None
+    ws._buffer = bytearray()
+    ws._zlib = zlib.decompressobj()
+    ws._keep_alive = None
+    ws._discord_parsers = {}
+    ws._dispatch_listeners = []
+    ws.sequence = None
+    ws.shard_id = None
+    ws.session_id = None
+    return ws
+
+
+def test_dump_round_trip_from_compressed_gateway():
+    payloads = [
+        {'op': 0, 's': 1, 't': 'GUILD_CREATE', 'd': {'id': '1', 'name': 'b\N{LATIN SMALL LETTER E WITH ACUTE}er'}},
+        {'op': 11, 's': None, 't': None, 'd': None},
+        {'op': 0, 's': 2, 't': 'MESSAGE_CREATE', 'd': {'id': '2', 'content': '?beer \N{BEER MUG}'}},
+    ]
+
+    # the gateway's zlib-stream: one compressor for the whole connection, each
+    # message ends in a sync flush and may arrive split over several frames
+    compressor = zlib.compressobj()
+    frames = []
+    for payload in payloads:
+        data = compressor.compress(json.dumps(payload).encode('utf-8'))
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        half = len(data) // 2
+        frames += [data[:half], data[half:]]
+
+    ring = EventRing(8)
+    ws = make_ws(ring)
+
+    async def feed():
+        for frame in frames:
+            await ws.received_message(frame)
+
+    asyncio.run(feed())
+
+    fp = io.BytesIO()
+    ring.dump(fp)
+    fp.seek(0)
+    records = list(read_dump(fp))
+
+    assert [t for _, t, _ in records] == ['GUILD_CREATE', None, 'MESSAGE_CREATE']
+    assert [json.loads(payload) for _, _, payload in records] == payloads
+    assert [timestamp for timestamp, _, _ in records] == [timestamp for timestamp, _, _ in ring]
+
+
+def test_ring_keeps_the_last_events():
+    ring = EventRing(2)
+    for n in range(5):
+        ring.append({'t': 'TYPING_START', 'd': n}, 'TYPING_START', timestamp=float(n))
+
+    fp = io.BytesIO()
+    ring.dump(fp)
+    fp.seek(0)
+    assert [(timestamp, json.loads(payload)['d']) for timestamp, _, payload in read_dump(fp)] == [(3.0, 3), (4.0, 4)]
+
+
+def test_payload_is_kept_as_captured():
+    ring = EventRing(4)
+    payload = {'op': 0, 't': 'GUILD_CREATE', 'd': {'members': [{'id': '1'}]}}
+    ring.capture(payload)
+    # discord.py's parsers are free to change the dict once it is dispatched
+    payload['d']['members'].clear()
+
+    (_, t, stored), = ring
+    assert isinstance(stored, bytes)
+    assert t == 'GUILD_CREATE'
+    assert json.loads(stored)['d']['members'] == [{'id': '1'}]
@@ -0,0 +1,146 @@
+import asyncio
+
+import discord
+
+from cogs.utils.webhook import MAX_CONTENT, MAX_EMBEDS, WebhookSink
+
+
+class _Response:
+    status = 500
+    reason = 'Internal Server Error'
+
+
+class FakeWebhook:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    async def send(self, **kwargs):
+        if self.fail:
+            raise discord.HTTPException(_Response(), 'nope')
+        self.sent.append(kwargs)
+
+
+def make_sink(webhook, **options):
+    return WebhookSink(webhook, loop=asyncio.get_running_loop(), **options)
+
+
+def test_lines_are_joined_per_sender():
+    async def run():
+        webhook = FakeWebhook()
+        sink = make_sink(webhook)
+        sink.send_line('one', username='a')
+        sink.send_line('two', username='a')
+        sink.send_line('three', username='b')
+        sink.send_line('four', username='a')
+        await sink.flush()
+        return webhook, sink
+
+    webhook, sink = asyncio.run(run())
+    assert [(kw['username'], kw['content']) for kw in webhook.sent] == [
+        ('a', 'one\ntwo'),
+        ('b', 'three'),
+        ('a', 'four'),
+    ]
+    assert sink.sent == 3 and len(sink) == 0
+
+
+def test_lines_are_split_at_the_content_limit():
+    async def run():
+        webhook = FakeWebhook()
+        sink = make_sink(webhook)
+        for _ in range(3):
+            sink.send_line('x' * 900)
+        sink.send_line('y' * (MAX_CONTENT + 10))
+        await sink.flush()
+        return webhook
+
+    webhook = asyncio.run(run())
+    contents = [kw['content'] for kw in webhook.sent]
+    assert contents == ['x' * 900 + '\n' + 'x' * 900, 'x' * 900, 'y' * MAX_CONTENT]
+
+
+def test_embeds_share_messages():
+    async def run():
+        webhook = FakeWebhook()
+        sink = make_sink(webhook)
+        for i in range(MAX_EMBEDS + 2):
+            sink.send_embed(discord.Embed(title=str(i)))
+        sink.send_line('after')
+        big = [discord.Embed(description='z' * 4000) for _ in range(2)]
+        for embed in big:
+            sink.send_embed(embed)
+        await sink.flush(max_sends=10)
+        return webhook
+
+    webhook = asyncio.run(run())
+    assert [len(kw.get('embeds', ())) for kw in webhook.sent] == [MAX_EMBEDS, 2, 0, 1, 1]
+    assert webhook.sent[2]['content'] == 'after'
+
+
+def test_drops_are_counted_and_reported():
+    async def run():
+        webhook = FakeWebhook()
+        sink = make_sink(webhook, max_queue=2)
+        for line in ('one', 'two', 'three', 'four'):
+            sink.send_line(line)
+        assert len(sink) == 2 and sink.dropped == 2
+        await sink.flush()
+        return webhook, sink
+
+    webhook, sink = asyncio.run(run())
+    content = webhook.sent[0]['content']
+    assert content.startswith('one\ntwo\n')
+    assert '2 webhook message(s) dropped' in content
+    assert sink.dropped == 0 and sink.dropped_total == 2
+
+
+def test_drop_notice_is_queued_after_embeds():
+    async def run():
+        webhook = FakeWebhook()
+        sink = make_sink(webhook, max_queue=1)
+        sink.send_embed(discord.Embed(title='a'))
+        sink.send_embed(discord.Embed(title='b'))
+        await sink.flush()
+        return webhook
+
+    webhook = asyncio.run(run())
+    assert len(webhook.sent) == 2
+    assert webhook.sent[0]['embeds'][0].title == 'a'
+    assert '1 webhook message(s) dropped' in webhook.sent[1]['content']
+
+
+def test_flush_drops_what_does_not_fit():
+    async def run():
+        webhook = FakeWebhook()
+        sink = make_sink(webhook)
+        for i in range(5):
+            sink.send_line(str(i), username=str(i))
+        await sink.flush(max_sends=3)
+        return webhook, sink
+
+    webhook, sink = asyncio.run(run())
+    assert [kw['content'] for kw in webhook.sent] == ['0', '1', '2']
+    assert len(sink) == 0 and sink.dropped_total == 2
+
+
+def test_failed_sends_do_not_stop_the_worker():
+    async def run():
+        webhook = FakeWebhook(fail=True)
+        sink = make_sink(webhook, interval=0)
+        sink.start()
+        sink.send_line('one', username='a')
+        sink.send_line('two', username='b')
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert len(sink) == 0 and not sink._task.done()
+        webhook.fail = False
+        sink.send_line('three')
+        for _ in range(10):
+            await asyncio.sleep(0)
+        sink.stop()
+        return webhook, sink
+
+    webhook, sink = asyncio.run(run())
+    assert [kw['content'] for kw in webhook.sent] == ['three']
+    assert sink.sent == 1
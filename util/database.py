@@ -1,19 +1,204 @@
-from sqlalchemy import MetaData
-from sqlalchemy.engine import Engine
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from sqlalchemy import MetaData, and_, create_engine, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import close_all_sessions, scoped_session, sessionmaker
+from sqlalchemy.orm import Session as SyncSession, close_all_sessions, scoped_session, sessionmaker
+
+from util.metrics import DB_QUERY_LATENCY
+
+try:
+    from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+except ImportError:
+    AsyncEngine = AsyncSession = create_async_engine = None
 
-__all__ = ("metadata", "base", "Base", "Session", "configure")
+__all__ = (
+    "metadata", "base", "Base", "Session", "configure", "create_engines",
+    "is_async", "run", "execute", "fetchall", "scalars", "upsert", "close",
+)
 
+T = TypeVar("T")
+
+# dialects with INSERT ... ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+# drivers that need an AsyncEngine, e.g. ``sqlite+aiosqlite:///cloudbot.db``
+ASYNC_DRIVERS = frozenset({"aiosqlite", "asyncpg", "asyncmy", "aiomysql"})
 
 Base = declarative_base()
 base = Base
 metadata: MetaData = Base.metadata
 Session = scoped_session(sessionmaker())
 
+_async_engine: Optional["AsyncEngine"] = None
+_async_session: Optional[sessionmaker] = None
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def create_engines(url: str, **kwargs) -> Tuple[Engine, Optional["AsyncEngine"]]:
+    """Builds the engines for a ``bot_options.database`` url.
+
+    The sync engine is always created and is used for startup loading and
+    ``db init``. The async engine is only created when the url names an
+    asyncio driver, otherwise queries are sent to a worker thread.
+    """
+    url = make_url(url)
+    if url.get_driver_name() not in ASYNC_DRIVERS:
+        return create_engine(url, future=True, **kwargs), None
+
+    if create_async_engine is None:
+        raise RuntimeError(f"{url.drivername} requires SQLAlchemy's asyncio extension")
+
+    sync_url = url.set(drivername=url.get_backend_name())
+    return create_engine(sync_url, future=True, **kwargs), create_async_engine(url, future=True, **kwargs)
+
+
+def configure(bind: Engine = None, future: bool = False, async_bind: "AsyncEngine" = None) -> None:
+    global _async_engine, _async_session
 
-def configure(bind: Engine = None, future: bool = False) -> None:
     metadata.bind = bind
     close_all_sessions()
     Session.remove()
     Session.configure(bind=bind, future=future)
+
+    _async_engine = async_bind
+    if async_bind is not None:
+        _async_session = sessionmaker(bind=async_bind, class_=AsyncSession, expire_on_commit=False)
+    else:
+        _async_session = None
+
+
+def is_async() -> bool:
+    """Whether queries run on an asyncio driver rather than the worker thread."""
+    return _async_session is not None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        # a single worker keeps writes ordered and SQLite happy
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+    return _executor
+
+
+def _run_in_worker(func, args, kwargs):
+    # a short-lived session per call, so no transaction is left open between queries
+    with Session.session_factory() as session:
+        return func(session, *args, **kwargs)
+
+
+async def run(func: Callable[..., T], *args, **kwargs) -> T:
+    """Runs ``func(session, *args, **kwargs)`` without blocking the event loop.
+
+    ``func`` is plain synchronous SQLAlchemy code and is responsible for
+    committing its own writes.
+    """
+    start = perf_counter()
+    try:
+        if _async_session is not None:
+            async with _async_session() as session:
+                return await session.run_sync(func, *args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        call = functools.partial(_run_in_worker, func, args, kwargs)
+        return await loop.run_in_executor(_get_executor(), call)
+    finally:
+        # includes waiting for the worker, which is what the caller feels
+        DB_QUERY_LATENCY.labels(getattr(func, '__name__', 'unknown')).observe(perf_counter() - start)
+
+
+def _execute(session: SyncSession, statement) -> int:
+    res = session.execute(statement)
+    session.commit()
+    return res.rowcount
+
+
+def _fetchall(session: SyncSession, statement) -> List[Any]:
+    return session.execute(statement).fetchall()
+
+
+def _scalars(session: SyncSession, statement) -> List[Any]:
+    return session.execute(statement).scalars().all()
+
+
+def upsert(
+    session: SyncSession,
+    table,
+    rows: Sequence[Dict[str, Any]],
+    index_elements: Iterable[str],
+    replace: Iterable[str] = (),
+    increment: Iterable[str] = (),
+) -> None:
+    """Inserts ``rows``, updating the existing row on a key conflict.
+
+    Columns in ``replace`` are overwritten with the new value, columns in
+    ``increment`` have the new value added to them. SQLite and Postgres get a
+    single ``INSERT ... ON CONFLICT DO UPDATE`` executemany, other dialects
+    fall back to an UPDATE and, when nothing matched, an INSERT per row.
+    The caller commits.
+    """
+    if not rows:
+        return
+
+    table = getattr(table, "__table__", table)
+    index_elements = list(index_elements)
+    replace = list(replace)
+    increment = list(increment)
+
+    dialect_insert = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table)
+        set_ = {name: stmt.excluded[name] for name in replace}
+        set_.update({name: table.c[name] + stmt.excluded[name] for name in increment})
+        if set_:
+            stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+        session.execute(stmt, list(rows))
+        return
+
+    for row in rows:
+        values = {name: row[name] for name in replace}
+        values.update({name: table.c[name] + row[name] for name in increment})
+        clause = and_(*(table.c[name] == row[name] for name in index_elements))
+        if values:
+            exists = session.execute(update(table).where(clause).values(**values)).rowcount
+        else:
+            exists = session.execute(select(table).where(clause)).first() is not None
+
+        if not exists:
+            session.execute(insert(table).values(**row))
+
+
+async def execute(statement) -> int:
+    """Executes and commits a write statement, returning its rowcount."""
+    return await run(_execute, statement)
+
+
+async def fetchall(statement) -> List[Any]:
+    """Executes a select and returns all of its rows."""
+    return await run(_fetchall, statement)
+
+
+async def scalars(statement) -> List[Any]:
+    """Executes a select and returns the first column of every row."""
+    return await run(_scalars, statement)
+
+
+async def close() -> None:
+    """Waits for queued queries and releases the engines."""
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    if _async_engine is not None:
+        await _async_engine.dispose()
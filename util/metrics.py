@@ -0,0 +1,262 @@
+"""In-process metrics, rendered in the Prometheus text exposition format.
+
+Metrics are registered once at import time and updated from the hot paths,
+so an update is a dict lookup and an add. Anything that is cheaper to read
+when scraped than to keep up to date is a :class:`Gauge` with a callback.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+__all__ = (
+    "Registry", "Counter", "Gauge", "Histogram", "REGISTRY",
+    "SOCKET_EVENTS", "MESSAGES", "COMMANDS", "COMMAND_LATENCY",
+    "LISTENER_LATENCY", "DB_QUERY_LATENCY", "DUCKS", "FACTOIDS",
+    "COMMAND_PHASE_LATENCY", "PROCESS_MEMORY", "GUILDS", "GATEWAY_LATENCY", "QUEUE_DEPTH", "CACHE_SIZE",
+)
+
+# seconds, from a cache hit up to a slow Discord round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, "_Metric"] = {}
+
+    def register(self, metric: "_Metric") -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional["_Metric"]:
+        return self.metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple, object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """The child for one combination of label values, created on first use."""
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}") from None
+            child = self._children[values] = self._new_child()
+            return child
+
+    def _default(self):
+        # unlabelled metrics keep their value in the () child
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeValue(_Value):
+    __slots__ = ("function",)
+
+    def __init__(self):
+        super().__init__()
+        self.function: Optional[Callable[[], float]] = None
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Reads the value from ``function`` whenever the metrics are rendered."""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Counter(_Metric):
+    """A count that only goes up, named with the ``_total`` suffix Prometheus expects."""
+
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def render(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default().set_function(function)
+
+    def render(self):
+        lines = []
+        for values, child in list(self._children.items()):
+            try:
+                value = child.get()
+            except Exception:
+                # a callback for something that has gone away, e.g. an unloaded cog
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * len(upper_bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.upper_bounds, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile, ``inf`` past the last one."""
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    @contextmanager
+    def time(self):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """Observations counted into ``buckets``, rendered cumulatively like Prometheus expects."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def render(self):
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(child.upper_bounds, child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {child.count}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+SOCKET_EVENTS = Counter("beeerbot_socket_events_total", "Gateway events received, by type", ["type"])
+MESSAGES = Counter("beeerbot_messages_total", "Messages seen by process_commands, by whether they had a prefix", ["result"])
+COMMANDS = Counter("beeerbot_commands_total", "Commands run, by name and whether they failed", ["command", "failed"])
+COMMAND_LATENCY = Histogram("beeerbot_command_seconds", "Time from parsing a command to it finishing")
+COMMAND_PHASE_LATENCY = Histogram(
+    "beeerbot_command_phase_seconds",
+    "Time per command, split into check, conversion, callback and send phases, plus the total",
+    ["command", "phase"],
+)
+LISTENER_LATENCY = Histogram("beeerbot_listener_seconds", "Time spent in on_message listeners", ["listener"])
+DB_QUERY_LATENCY = Histogram("beeerbot_db_query_seconds", "Time spent in database.run calls, by function", ["function"])
+DUCKS = Counter("beeerbot_ducks_deployed_total", "Ducks deployed")
+FACTOIDS = Counter("beeerbot_factoid_lookups_total", "Factoid lookups, by result", ["result"])
+PROCESS_MEMORY = Gauge("beeerbot_process_memory_bytes", "Memory used by the bot process", ["kind"])
+GUILDS = Gauge("beeerbot_guilds", "Guilds the bot is in")
+GATEWAY_LATENCY = Gauge("beeerbot_gateway_latency_seconds", "Time between a gateway heartbeat and its ack")
+QUEUE_DEPTH = Gauge("beeerbot_queue_depth", "Items waiting in the bot's in-memory queues", ["queue"])
+CACHE_SIZE = Gauge("beeerbot_cache_entries", "Entries held by the bot's caches", ["cache"])